@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    def __init__(self, reason):
+        super().__init__(f"server overloaded ({reason.replace('_', ' ')})")
+        self.reason = reason
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """The latency budget of one request.
+
+    Work cannot be interrupted from outside a thread, so the request checks
+    its deadline between stages and gives up as soon as it has passed.
+    seconds=None means no deadline.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self, stage):
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+
+class AdmissionController:
+    """Limits the requests handled at once, with a bounded queue in front.
+
+    Up to max_in_flight requests run together; up to max_queue more wait
+    for a slot in arrival order, for at most queue_timeout seconds or until
+    their deadline. A finished request hands its slot straight to the
+    oldest waiting one, so a newcomer never takes it first. Anything
+    beyond that is rejected at once with Overloaded, so a spike is shed
+    instead of building up latency. max_in_flight=0 admits everything.
+    """
+
+    def __init__(self, max_in_flight=0, max_queue=0, queue_timeout=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # One event per waiting request, oldest first; it is set when the request gets a slot
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        with self.lock:
+            if not self.max_in_flight or (self.in_flight < self.max_in_flight and not self.waiters):
+                self.in_flight += 1
+                return
+            if len(self.waiters) >= self.max_queue:
+                raise Overloaded('queue_full')
+            waiter = threading.Event()
+            self.waiters.append(waiter)
+
+        timeouts = [timeout for timeout in (self.queue_timeout, deadline and deadline.remaining())
+                    if timeout is not None]
+        if waiter.wait(min(timeouts) if timeouts else None):
+            return
+        with self.lock:
+            # The slot may have been handed over just as the wait timed out
+            if waiter.is_set():
+                return
+            self.waiters.remove(waiter)
+        if deadline is not None:
+            deadline.check('queue')
+        raise Overloaded('queue_timeout')
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                # The slot goes to the oldest waiting request, so in_flight stays the same
+                self.waiters.popleft().set()
+            else:
+                self.in_flight -= 1
+
+    @contextmanager
+    def admit(self, deadline=None):
+        self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self.lock:
+            return {'in_flight': self.in_flight, 'waiting': len(self.waiters),
+                    'max_in_flight': self.max_in_flight, 'max_queue': self.max_queue}
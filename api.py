@@ -1,345 +1,655 @@
-import numpy as np
-from flask import Flask, request, jsonify, render_template_string
-import pickle
-import pandas as pd
-from car_data_prep import prepare_data 
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
+import gzip
+import hashlib
+import json
+import math
 import os
+import pickle
+import signal
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from inference import prediction_cache_key, RowDroppedError
+from request_schema import parse_car, parse_sweep, InvalidRequest
+from prediction_cache import PredictionCache
+from model_registry import ModelRegistry
+from metrics import MetricsRegistry, Counter, Gauge
+from micro_batching import MicroBatcher
+from profiling import RequestProfiler
+from admission import AdmissionController, Deadline, DeadlineExceeded, Overloaded
+from request_log import RequestLogger
+
+# numpy and pandas are imported by the functions that build DataFrames, so a worker serving
+# a compact model (MODEL_PATH pointing to a directory written by compact_model) never loads them
 
 app = Flask(__name__)
 
-# Load the trained model
-model = pickle.load(open('trained_model.pkl', 'rb'))
+# List of all required columns, in the layout of dataset.csv
+COLUMNS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type',
+           'Prev_ownership', 'Curr_ownership', 'Area', 'City', 'Price', 'Pic_num', 'Cre_date',
+           'Repub_date', 'Description', 'Color', 'Km', 'Test', 'Supply_score']
+
+# Columns read as text in batch input; pandas would otherwise guess a type for each chunk,
+# and a chunk where every model is a number (Mazda 3, Peugeot 208) would get int models
+TEXT_COLUMNS = ['manufactor', 'model', 'Gear', 'Engine_type', 'Prev_ownership', 'Curr_ownership',
+                'Area', 'City', 'Cre_date', 'Repub_date', 'Description', 'Color', 'Test']
+
+# A typical car, predicted once by every new model before it takes traffic
+WARMUP_CAR = {
+    'manufactor': 'יונדאי', 'Year': '2015', 'model': 'i35', 'Hand': '2', 'Gear': 'אוטומטית',
+    'capacity_Engine': '1600', 'Engine_type': 'בנזין', 'Prev_ownership': 'פרטית',
+    'Curr_ownership': 'פרטית', 'Description': '', 'Km': '144000', 'Test': ''
+}
+
+# Cache of recent predictions, keyed on the form fields that reach the model
+prediction_cache = PredictionCache(
+    max_size=int(os.environ.get('PREDICT_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('PREDICT_CACHE_TTL', 300))
+)
+
+# Number of cars prepared and predicted together by /predict/batch
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 1000))
+
+# Request counters and latency histograms, served at /metrics
+metrics = MetricsRegistry()
+REQUESTS = metrics.counter('http_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'status'])
+REQUEST_SECONDS = metrics.histogram('http_request_duration_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+IN_FLIGHT = metrics.gauge('http_requests_in_flight', 'HTTP requests being handled')
+PREDICT_STAGE_SECONDS = metrics.histogram('predict_stage_duration_seconds', 'Latency of each /predict stage', ['stage'])
+PREDICT_ERRORS = metrics.counter('predict_errors_total', 'Failed /predict requests by stage', ['stage'])
+PREDICT_BATCH_SIZE = metrics.histogram('predict_micro_batch_size', 'Cars predicted together by the /predict micro-batcher',
+                                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+def cache_metrics():
+    stats = prediction_cache.stats()
+    collected = []
+    for name in ['hits', 'misses', 'evictions', 'expirations', 'invalidations']:
+        counter = Counter(f'prediction_cache_{name}_total', f'Prediction cache {name}')
+        counter.inc(amount=stats[name])
+        collected.append(counter)
+    size = Gauge('prediction_cache_size', 'Entries in the prediction cache')
+    size.set(stats['size'])
+    collected.append(size)
+    return collected
+
+metrics.add_collector(cache_metrics)
+
+# The pid of the serve.py master, set in each worker it forks. Every worker has its own model
+# registry, prediction cache and metrics, so model changes go through the master and the
+# metrics of each worker carry a worker label.
+master_pid = None
+
+def worker_label():
+    return [('worker', os.getpid())] if master_pid else []
+
+# Token required by the /admin endpoints; without one they are disabled
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# How long browsers may reuse the index page before revalidating it with its ETag
+INDEX_MAX_AGE = int(os.environ.get('INDEX_MAX_AGE', 60))
+
+# The rendered index page of each model version: {encoding: (body, etag)}
+index_pages = {}
+
+def render_index(loaded):
+    # The manufacturers the model knows, or the ones seen by the data preparer for models without a one-hot encoder
+    manufactors = loaded.categories('manufactor') or sorted(loaded.preparer.engine_type_mode_by_manufactor_)
+    with app.app_context():
+        html = render_template('index.html', manufactors=manufactors).encode('utf-8')
+    compressed = gzip.compress(html, compresslevel=9, mtime=0)
+    # Each encoding is a different representation, so each gets its own strong ETag
+    page = {encoding: (body, hashlib.sha256(body).hexdigest()[:20])
+            for encoding, body in [('identity', html), ('gzip', compressed)]}
+
+    # Keep the pages of the versions the registry still holds
+    for version in list(index_pages):
+        if version not in registry.versions:
+            index_pages.pop(version, None)
+    index_pages[loaded.version] = page
+    return page
+
+def warm_up(loaded):
+    # Run the sample car through both prediction paths; a compact model only has the compiled one
+    if loaded.compiled is not None:
+        loaded.compiled.predict(WARMUP_CAR)
+    if loaded.pipeline is not None:
+        loaded.predict_frame(build_input_frame(WARMUP_CAR))
+    render_index(loaded)
+
+# The trained model and the data preparer fitted on the training data, loaded on first use
+registry = ModelRegistry(
+    os.environ.get('MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trained_model.pkl')),
+    keep=int(os.environ.get('MODEL_KEEP_VERSIONS', 3)),
+    warm_up=warm_up,
+    watch_interval=float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+)
 
 @app.route('/')
 def index():
-    html_content = '''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Car Price Prediction</title>
-        <link href="https://fonts.googleapis.com/css2?family=Heebo:wght@300&display=swap" rel="stylesheet">
-        <style>
-            body {
-                font-family: 'Heebo', sans-serif;
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-                background-color: #f0f0f0;
-                margin: 0;
-                padding: 0;
-            }
-            .container {
-                background-color: #fff;
-                border-radius: 10px;
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
-                padding: 20px;
-                margin-top: 50px;
-                max-width: 500px;
-                width: 100%;
-                position: relative;
-            }
-            .background-layer {
-                position: absolute;
-                top: 0;
-                left: 0;
-                width: 100%;
-                height: 100%;
-                background: url('https://yahad-motors.co.il/wp-content/uploads/2022/12/shutterstock_797260003-min-1536x932.jpg') no-repeat center center/cover;
-                opacity: 0.2; /* Change the opacity as needed */
-                border-radius: 10px;
-                z-index: 0;
-            }
-            .content {
-                position: relative;
-                z-index: 1;
-            }
-            h1 {
-                color: #007bff;
-            }
-            h2 {
-                color: #555;
-            }
-            label {
-                display: block;
-                margin-top: 10px;
-                font-weight: bold;
-            }
-            .required:after {
-                content: '*';
-                color: red;
-                margin-left: 5px;
-            }
-            input[type="text"], select, input[list] {
-                width: calc(100% - 22px);
-                padding: 10px;
-                margin-top: 5px;
-                margin-bottom: 10px;
-                border: 1px solid #ccc;
-                border-radius: 5px;
-            }
-            button {
-                background-color: #007bff;
-                color: #fff;
-                padding: 10px 20px;
-                border: none;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 16px;
-                transition: background-color 0.3s ease;
-            }
-            button:hover {
-                background-color: #0056b3;
-            }
-            .error-message {
-                color: red;
-                display: none;
-                margin-top: 10px;
-            }
-            #prediction-text {
-                margin-top: 20px;
-                font-size: 18px;
-                font-weight: bold;
-                color: #28a745;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="background-layer"></div>
-            <div class="content">
-                <h1>Car Price Prediction</h1>
-                <h2>Enter the car's data: </h2>
-                <form id="measurement-form">
-                    <label for="manufactor" class="required">Manufactor:</label>
-                    <input list="manufactors" id="manufactor" name="manufactor">
-                    <datalist id="manufactors">
-                        <option value="אאודי">
-                        <option value="אברת'">
-                        <option value="אוטוביאנקי">
-                        <option value="אולדסמוביל">
-                        <option value="אוסטין">
-                        <option value="אופל">
-                        <option value="אינפיניטי">
-                        <option value="אלפא רומיאו">
-                        <option value="אם. ג'י. / MG">
-                        <option value="ב.מ.וו">
-                        <option value="ביואיק">
-                        <option value="גרייט וול / G.O">
-                        <option value="דאצ'יה">
-                        <option value="דודג'">
-                        <option value="דייהו">
-                        <option value="דייהטסו">
-                        <option value="הונדה">
-                        <option value="וולוו">
-                        <option value="טויוטה">
-                        <option value="טסלה">
-                        <option value="יגואר">
-                        <option value="יונדאי">
-                        <option value="לאדה">
-                        <option value="לינקולן">
-                        <option value="לנצ'יה">
-                        <option value="לקסוס">
-                        <option value="מאזדה">
-                        <option value="מזראטי">
-                        <option value="מיני">
-                        <option value="מיצובישי">
-                        <option value="מרצדס">
-                        <option value="ניסאן">
-                        <option value="סאאב">
-                        <option value="סאנגיונג">
-                        <option value="סובארו">
-                        <option value="סוזוקי">
-                        <option value="סיאט">
-                        <option value="סיטרואן">
-                        <option value="סמארט">
-                        <option value="סקודה">
-                        <option value="פולקסווגן">
-                        <option value="פונטיאק">
-                        <option value="פורד">
-                        <option value="פורשה">
-                        <option value="פיאט">
-                        <option value="פיג'ו">
-                        <option value="פרארי">
-                        <option value="קאדילק">
-                        <option value="קיה">
-                        <option value="קרייזלר">
-                        <option value="רובר">
-                        <option value="רנו">
-                        <option value="שברולט">
-                    </datalist>
-                    <label for="year" class="required">Year:</label>
-                    <input type="text" id="year" name="Year">
-                    <label for="model" class="required">Model:</label>
-                    <input type="text" id="model" name="model">
-                    <label for="hand" class="required">Hand:</label>
-                    <input type="text" id="hand" name="Hand">
-                    <label for="gear" class="required">Gear:</label>
-                    <select id="gear" name="Gear">
-                        <option value="">Select Gear Type</option>
-                        <option value="אוטומטית">אוטומטית</option>
-                        <option value="ידנית">ידנית</option>
-                        <option value="טיפטרוניק">טיפטרוניק</option>
-                        <option value="רובוטית">רובוטית</option>
-                    </select>
-                    <label for="capacity_Engine" class="required">Capacity Engine:</label>
-                    <input type="text" id="capacity_Engine" name="capacity_Engine">
-                    <label for="engine_type" class="required">Engine Type:</label>
-                    <select id="engine_type" name="Engine_type">
-                        <option value="">Select Engine Type</option>
-                        <option value="בנזין">בנזין</option>
-                        <option value="דיזל">דיזל</option>
-                        <option value="גז">גז</option>
-                        <option value="היברידי">היברידי</option>
-                        <option value="חשמלי">חשמלי</option>
-                    </select>
-                    <label for="prev_ownership" class="required">Previous Ownership:</label>
-                    <select id="prev_ownership" name="Prev_ownership">
-                        <option value="">Select Previous Ownership</option>
-                        <option value="פרטית">פרטית</option>
-                        <option value="חברה">חברה</option>
-                        <option value="השכרה">השכרה</option>
-                        <option value="ליסינג">ליסינג</option>
-                        <option value="מונית">מונית</option>
-                        <option value="לימוד נהיגה">לימוד נהיגה</option>
-                        <option value="ייבוא אישי">ייבוא אישי</option>
-                        <option value="ממשלתי">ממשלתי</option>
-                        <option value="אחר">אחר</option>
-                    </select>
-                    <label for="curr_ownership" class="required">Current Ownership:</label>
-                    <select id="curr_ownership" name="Curr_ownership">
-                        <option value="">Select Current Ownership</option>
-                        <option value="פרטית">פרטית</option>
-                        <option value="חברה">חברה</option>
-                        <option value="השכרה">השכרה</option>
-                        <option value="ליסינג">ליסינג</option>
-                        <option value="מונית">מונית</option>
-                        <option value="לימוד נהיגה">לימוד נהיגה</option>
-                        <option value="ייבוא אישי">ייבוא אישי</option>
-                        <option value="ממשלתי">ממשלתי</option>
-                        <option value="אחר">אחר</option>
-                    </select>
-                    <label for="description" class="required">Description:</label>
-                    <input type="text" id="description" name="Description">
-                    <label for="km" class="required">Kilometers:</label>
-                    <input type="text" id="km" name="Km">
-                    <label for="test" class="required">Test (DD/MM/YYYY):</label>
-                    <input type="text" id="test" name="Test" placeholder="DD/MM/YYYY">
-                    <button type="submit">Calculate Price</button>  
-                    <p class="error-message" id="error-message">חסר פרטים, אנא מלא את כל השדות המסומנים</p>
-                </form>
-                <h3 id="prediction-text"></h3>
-            </div>
-        </div>
-        <script>
-            document.getElementById('measurement-form').addEventListener('submit', function(event) {
-                event.preventDefault();
-                if (validateForm()) {
-                    const formData = new FormData(this);
-                    fetch('/predict', {
-                        method: 'POST',
-                        body: formData
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        document.getElementById('prediction-text').textContent = data.prediction;
-                    })
-                    .catch(error => {
-                        console.error('Error:', error);
-                    });
-                }
-            });
-
-            function validateForm() {
-                const requiredFields = ['manufactor', 'year', 'model', 'hand', 'gear', 'capacity_Engine', 'engine_type', 'prev_ownership', 'curr_ownership', 'description', 'km', 'test'];
-                let valid = true;
-                requiredFields.forEach(function(field) {
-                    const input = document.getElementById(field);
-                    if (!input.value.trim()) {
-                        valid = false;
-                        input.previousElementSibling.style.color = 'red';
-                    } else {
-                        input.previousElementSibling.style.color = 'black';
-                    }
-                });
-                const testField = document.getElementById('test');
-                const testPattern = /^\d{2}\/\d{2}\/\d{4}$/;
-                if (!testPattern.test(testField.value.trim())) {
-                    valid = false;
-                    testField.previousElementSibling.style.color = 'red';
-                } else {
-                    testField.previousElementSibling.style.color = 'black';
-                }
-                if (!valid) {
-                    document.getElementById('error-message').style.display = 'block';
-                } else {
-                    document.getElementById('error-message').style.display = 'none';
-                }
-                return valid;
-            }
-        </script>
-    </body>
-    </html>
-    '''
-    return render_template_string(html_content)
+    # The page is rendered once per model version and served from memory
+    loaded = registry.current()
+    page = index_pages.get(loaded.version) or render_index(loaded)
+    encoding = 'gzip' if request.accept_encodings['gzip'] else 'identity'
+    body, etag = page[encoding]
+
+    response = Response(body, mimetype='text/html')
+    if encoding == 'gzip':
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={INDEX_MAX_AGE}'
+    response.set_etag(etag)
+    # Answers 304 Not Modified when the browser already has this version
+    return response.make_conditional(request)
+
+def build_input_frame(input_data):
+    import numpy as np
+    import pandas as pd
+
+    # Create DataFrame with the required columns and leave columns not in the form as empty
+    input_df = pd.DataFrame(columns=COLUMNS)
+    input_df.loc[0] = np.nan  # Add empty row
+
+    # Insert data from the form into the DataFrame
+    for key, value in input_data.items():
+        input_df.at[0, key] = value
+
+    # Convert to numeric values for appropriate columns
+    numeric_columns = ['Year', 'Hand', 'capacity_Engine', 'Km']
+    for col in numeric_columns:
+        if col in input_df.columns:
+            input_df[col] = pd.to_numeric(input_df[col], errors='coerce')
+    return input_df
+
+def build_records_frame(records):
+    import pandas as pd
+
+    # One row per car, like build_input_frame for each of them
+    input_df = pd.DataFrame.from_records(records).reindex(columns=COLUMNS)
+    for col in ['Year', 'Hand', 'capacity_Engine', 'Km']:
+        input_df[col] = pd.to_numeric(input_df[col], errors='coerce')
+    return input_df
+
+def predict_micro_batch(items):
+    # items are (loaded model, form data) pairs; the cars of each model version are predicted together
+    results = [None] * len(items)
+    by_version = {}
+    for position, (loaded, input_data) in enumerate(items):
+        by_version.setdefault(loaded.version, (loaded, []))[1].append(position)
+
+    for loaded, positions in by_version.values():
+        try:
+            predictions = loaded.predict_frame(build_records_frame([items[position][1] for position in positions]))
+        except Exception:
+            # One bad car must not fail the others, so they are predicted one by one
+            for position in positions:
+                try:
+                    results[position] = predict_with_pandas(loaded, items[position][1])
+                except Exception as e:
+                    results[position] = e
+            continue
+        for row, position in enumerate(positions):
+            if row in predictions.index:
+                results[position] = float(predictions[row])
+            else:
+                results[position] = RowDroppedError("Row was dropped during data preparation")
+    return results
+
+# Concurrent /predict cache misses of models without a compiled path can be gathered into
+# one DataFrame pass (off unless a window is set)
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 0))
+predict_batcher = MicroBatcher(
+    predict_micro_batch,
+    max_batch_size=int(os.environ.get('PREDICT_BATCH_MAX_SIZE', 64)),
+    max_wait=PREDICT_BATCH_WINDOW_MS / 1000,
+    on_batch=PREDICT_BATCH_SIZE.observe
+) if PREDICT_BATCH_WINDOW_MS > 0 else None
+
+def csv_chunks(stream):
+    import pandas as pd
+
+    # The CSV is read chunk by chunk, so a large upload is never held in memory
+    for chunk in pd.read_csv(stream, chunksize=BATCH_CHUNK_SIZE, dtype={column: str for column in TEXT_COLUMNS}):
+        yield chunk.reindex(columns=COLUMNS)
+
+def json_text_values(record):
+    # JSON clients may send a model name like 3 as a number, which request_schema._text also accepts
+    return {key: str(value) if key in TEXT_COLUMNS and isinstance(value, (int, float)) and not isinstance(value, bool)
+            and not (isinstance(value, float) and math.isnan(value)) else value
+            for key, value in record.items()}
+
+def json_chunks(records):
+    import pandas as pd
+
+    for start in range(0, len(records), BATCH_CHUNK_SIZE):
+        chunk = [json_text_values(record) for record in records[start:start + BATCH_CHUNK_SIZE]]
+        yield pd.DataFrame.from_records(chunk).reindex(columns=COLUMNS)
+
+def predict_rows(loaded, chunk):
+    import pandas as pd
+
+    # The predictions of a chunk and the error of each row that fails. A chunk that fails is split
+    # in halves until the failing rows are alone, so one bad row does not fail the rows around it
+    # and costs a few more passes instead of one pass per row.
+    try:
+        return loaded.predict_frame(chunk), {}
+    except Exception as e:
+        if len(chunk) == 1:
+            print(f"Error during batch prediction of row {chunk.index[0]}: {e}")
+            return pd.Series(dtype=float), {chunk.index[0]: f"Error during prediction: {e}"}
+    middle = len(chunk) // 2
+    parts = [predict_rows(loaded, chunk.iloc[:middle]), predict_rows(loaded, chunk.iloc[middle:])]
+    predictions = [part for part, _ in parts if len(part)]
+    return (pd.concat(predictions) if predictions else pd.Series(dtype=float)), {**parts[0][1], **parts[1][1]}
+
+def predict_chunk(loaded, chunk):
+    import pandas as pd
+
+    # Convert to numeric values for the columns used in arithmetic
+    for col in ['Year', 'Hand']:
+        chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+    predictions, errors = predict_rows(loaded, chunk)
+
+    # One NDJSON line per input row, in input order
+    lines = []
+    for index in chunk.index:
+        if index in predictions.index:
+            lines.append(json.dumps({'row': index, 'prediction': round(float(predictions[index]), 2)}))
+        else:
+            error = errors.get(index, "Row was dropped during data preparation")
+            lines.append(json.dumps({'row': index, 'error': error}, ensure_ascii=False))
+    return '\n'.join(lines) + '\n'
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    loaded = registry.get(request.headers.get('X-Model-Version'))
+    if loaded is None:
+        return jsonify(error="Unknown model version"), 404
+
+    # The body is an uploaded CSV file, a raw text/csv body or a JSON array of cars
+    if 'file' in request.files:
+        chunks = csv_chunks(request.files['file'])
+    elif request.mimetype == 'text/csv':
+        chunks = csv_chunks(request.stream)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify(error="Expected a JSON array of cars or a CSV file"), 400
+        # The array is already in memory, so bad elements are refused before any line is streamed
+        not_objects = [row for row, record in enumerate(records) if not isinstance(record, dict)]
+        if not_objects:
+            return jsonify(error="Every car must be a JSON object", rows=not_objects[:100]), 400
+        chunks = json_chunks(records)
+
+    def generate():
+        import pandas as pd
+
+        row = 0
+        try:
+            for chunk in chunks:
+                chunk.index = pd.RangeIndex(row, row + len(chunk))
+                row += len(chunk)
+                yield predict_chunk(loaded, chunk)
+        except Exception as e:
+            # The input itself could not be read any further
+            print(f"Error reading batch input: {e}")
+            yield json.dumps({'row': row, 'error': f"Error reading input: {e}"}, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def build_grid_frame(input_data, axes):
+    import numpy as np
+
+    # One row per point of the grid: the base car repeated, with the swept columns from the
+    # mesh of the axes, so the first axis varies slowest like in the returned matrix
+    base = build_input_frame(input_data)
+    mesh = np.meshgrid(*axes.values(), indexing='ij')
+    input_df = base.loc[base.index.repeat(mesh[0].size)].reset_index(drop=True)
+    for field, values in zip(axes, mesh):
+        input_df[field] = values.ravel()
+    return input_df
+
+@app.route('/predict/sweep', methods=['POST'])
+def predict_sweep():
+    # The body is {"car": {...}, "sweep": {"Year": {"start": 2010, "stop": 2020}, "Hand": [1, 2, 3]}}
+    try:
+        record, axes = parse_sweep(request.get_json(silent=True))
+    except InvalidRequest as e:
+        return jsonify(error=f"Invalid input: {e}", errors=e.errors), 400
+    loaded = registry.get(request.headers.get('X-Model-Version'))
+    if loaded is None:
+        return jsonify(error="Unknown model version"), 404
+
+    # The whole grid is prepared and predicted as one DataFrame
+    try:
+        predictions = loaded.predict_frame(build_grid_frame(record.as_dict(), axes))
+    except Exception as e:
+        print(f"Error during sweep prediction: {e}")
+        return jsonify(error=f"Error during prediction: {e}"), 500
+
+    # Prices as nested lists with one level per axis, null for points dropped by the preparation
+    shape = [len(values) for values in axes.values()]
+    prices = predictions.reindex(range(math.prod(shape))).round(2)
+    return jsonify(axes=[{'field': field, 'values': values} for field, values in axes.items()],
+                   prices=prices.astype(object).where(prices.notna(), None).to_numpy().reshape(shape).tolist(),
+                   model_version=loaded.version)
+
+# Opt-in cProfile of single /predict calls: with PROFILE_PREDICT=header, requests sending
+# 'X-Profile: 1' get the report in their response; PROFILE_PREDICT=always profiles every call
+profiler = RequestProfiler(
+    mode=os.environ.get('PROFILE_PREDICT', 'off'),
+    directory=os.environ.get('PROFILE_DIR') or None,
+    top=int(os.environ.get('PROFILE_TOP', 30))
+)
+
+# Admission control of /predict: at most PREDICT_MAX_IN_FLIGHT requests are handled at once (0 for no limit),
+# PREDICT_MAX_QUEUE more wait up to PREDICT_QUEUE_TIMEOUT seconds for a slot, the rest get a 503 at once
+admission = AdmissionController(
+    max_in_flight=int(os.environ.get('PREDICT_MAX_IN_FLIGHT', 32)),
+    max_queue=int(os.environ.get('PREDICT_MAX_QUEUE', 64)),
+    queue_timeout=float(os.environ.get('PREDICT_QUEUE_TIMEOUT', 1))
+)
+RETRY_AFTER = int(os.environ.get('PREDICT_RETRY_AFTER', 1))
+
+# Latency budget of a /predict request in milliseconds: the client's X-Timeout-Ms header,
+# capped by PREDICT_DEADLINE_MS when it is set (0 for no server-side deadline)
+PREDICT_DEADLINE_MS = float(os.environ.get('PREDICT_DEADLINE_MS', 0))
+
+PREDICT_SHED = metrics.counter('predict_shed_total', '/predict requests rejected by admission control', ['reason'])
+PREDICT_TIMEOUTS = metrics.counter('predict_deadline_exceeded_total', '/predict requests that ran out of time by stage', ['stage'])
+
+def admission_metrics():
+    stats = admission.stats()
+    collected = []
+    for name, help in [('in_flight', 'handled'), ('waiting', 'waiting for a slot')]:
+        gauge = Gauge(f'predict_admission_{name}', f'/predict requests {help}')
+        gauge.set(stats[name])
+        collected.append(gauge)
+    return collected
+
+metrics.add_collector(admission_metrics)
+
+# Every /predict input with its prediction, appended to REQUEST_LOG_PATH by a background thread
+# (an empty REQUEST_LOG_PATH turns the log off); rotated at REQUEST_LOG_MAX_BYTES or REQUEST_LOG_MAX_AGE seconds
+REQUEST_LOG_PATH = os.environ.get('REQUEST_LOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'requests.jsonl'))
+request_log = RequestLogger(
+    REQUEST_LOG_PATH,
+    capacity=int(os.environ.get('REQUEST_LOG_BUFFER', 10000)),
+    flush_interval=float(os.environ.get('REQUEST_LOG_FLUSH_INTERVAL', 1)),
+    max_bytes=int(os.environ.get('REQUEST_LOG_MAX_BYTES', 50 * 1024 * 1024)),
+    max_age=float(os.environ.get('REQUEST_LOG_MAX_AGE', 0)) or None
+) if REQUEST_LOG_PATH else None
+
+def request_log_metrics():
+    stats = request_log.stats()
+    collected = []
+    for name, help in [('written', 'Records written to the request log'), ('dropped', 'Records dropped by the request log'),
+                       ('rotations', 'Rotations of the request log file'), ('errors', 'Failed writes to the request log')]:
+        counter = Counter(f'request_log_{name}_total', help)
+        counter.inc(amount=stats[name])
+        collected.append(counter)
+    buffered = Gauge('request_log_buffered', 'Request log records waiting to be written')
+    buffered.set(stats['buffered'])
+    collected.append(buffered)
+    return collected
+
+if request_log is not None:
+    metrics.add_collector(request_log_metrics)
+
+def log_prediction(input_data, loaded=None, prediction=None, error=None):
+    # The record is serialized and written by the logger thread
+    if request_log is not None:
+        request_log.log({'time': time.time(), 'model_version': loaded.version if loaded is not None else None,
+                         'input': input_data, 'prediction': prediction, 'error': error})
+
+def valid_budget(milliseconds):
+    # inf, nan, zero and negative budgets are ignored rather than turned into a deadline
+    return math.isfinite(milliseconds) and milliseconds > 0
+
+def request_deadline():
+    budgets = [PREDICT_DEADLINE_MS] if valid_budget(PREDICT_DEADLINE_MS) else []
+    try:
+        budget = float(request.headers['X-Timeout-Ms'])
+    except (KeyError, ValueError):
+        budget = None
+    if budget is not None and valid_budget(budget):
+        budgets.append(budget)
+    return Deadline(min(budgets) / 1000 if budgets else None)
 
 @app.route('/predict', methods=['POST'])
 def predict():
+    deadline = request_deadline()
+    try:
+        with admission.admit(deadline):
+            # When an admin token is set, only admins can ask for a profile
+            if profiler.requested(request.headers) and (profiler.mode == 'always' or not ADMIN_TOKEN
+                                                        or request.headers.get('X-Admin-Token') == ADMIN_TOKEN):
+                response, report = profiler.run(predict_car, profiling=True, deadline=deadline)
+                response = app.make_response(response)
+                return jsonify(dict(response.get_json(), profile=report)), response.status_code
+            return predict_car(deadline=deadline)
+    except Overloaded as e:
+        PREDICT_SHED.inc(e.reason)
+        return jsonify(prediction=f"Error during prediction: {e}"), 503, {'Retry-After': str(RETRY_AFTER)}
+    except DeadlineExceeded as e:
+        PREDICT_TIMEOUTS.inc(e.stage)
+        return jsonify(prediction=f"Error during prediction: {e}"), 504
+
+def predict_car(profiling=False, deadline=None):
+    deadline = deadline or Deadline()
+    stage = 'parse'
+    input_data = loaded = None
     try:
-        input_data = {
-            'manufactor': request.form.get('manufactor', ''),
-            'Year': request.form.get('Year', ''),
-            'model': request.form.get('model', ''),
-            'Hand': request.form.get('Hand', ''),
-            'Gear': request.form.get('Gear', ''),
-            'capacity_Engine': request.form.get('capacity_Engine', ''),
-            'Engine_type': request.form.get('Engine_type', ''),
-            'Prev_ownership': request.form.get('Prev_ownership', ''),
-            'Curr_ownership': request.form.get('Curr_ownership', ''),
-            'Description': request.form.get('Description', ''),
-            'Km': request.form.get('Km', ''),
-            'Test': request.form.get('Test', '')
-        }
-
-        # List of all required columns
-        columns = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type', 
-                   'Prev_ownership', 'Curr_ownership', 'Area', 'City', 'Price', 'Pic_num', 'Cre_date', 
-                   'Repub_date', 'Description', 'Color', 'Km', 'Test', 'Supply_score']
-
-        # Create DataFrame with the required columns and leave columns not in the form as empty
-        input_df = pd.DataFrame(columns=columns)
-        input_df.loc[0] = np.nan  # Add empty row
-
-        # Insert data from the form into the DataFrame
-        for key, value in input_data.items():
-            input_df.at[0, key] = value
-
-        # Convert to numeric values for appropriate columns
-        numeric_columns = ['Year', 'Hand', 'capacity_Engine', 'Km']
-        for col in numeric_columns:
-            if col in input_df.columns:
-                input_df[col] = pd.to_numeric(input_df[col], errors='coerce')
-
-        # Prepare data using prepare_data function
-        prepared_data = prepare_data(input_df)
-
-        # Get the ColumnTransformer from the trained model
-        preprocessor = model.named_steps['preprocessor']
-
-        # Process the data using the ColumnTransformer from the trained model
-        processed_data = preprocessor.transform(prepared_data)
-
-        # Predict the price
-        prediction = model.named_steps['model'].predict(processed_data)[0]
+        # Form or JSON bodies are validated and coerced in one pass, before any preparation work
+        with PREDICT_STAGE_SECONDS.time('parse'):
+            try:
+                data = request.get_json(silent=True) if request.is_json else request.form
+                input_data = parse_car(data).as_dict()
+            except InvalidRequest as e:
+                PREDICT_ERRORS.inc('validate')
+                return jsonify(prediction=f"Invalid input: {e}", errors=e.errors), 400
+
+        # Requests can be pinned to one of the loaded model versions
+        stage = 'load_model'
+        requested_version = request.headers.get('X-Model-Version')
+        loaded = registry.get(requested_version)
+        if loaded is None:
+            return jsonify(prediction=f"Unknown model version: {requested_version}"), 404
+
+        # Repeated cars are answered from the cache without preparing the data again.
+        # Pinned requests skip it, so they do not invalidate it for everyone else,
+        # and profiled requests skip it so the profile shows the prediction itself.
+        stage = 'cache'
+        use_cache = not requested_version and not profiling
+        with PREDICT_STAGE_SECONDS.time(stage):
+            cache_key = prediction_cache_key(input_data)
+            prediction = prediction_cache.get(cache_key, loaded.version) if use_cache else None
+        if prediction is None:
+            # Only pandas-path models gain from a shared DataFrame pass; a compiled model predicts one car
+            # faster than a batch, and the micro-batcher predicts in its own thread, out of sight of the profiler
+            if predict_batcher is not None and not profiling and loaded.compiled is None:
+                stage = 'micro_batch'
+                with PREDICT_STAGE_SECONDS.time(stage):
+                    try:
+                        prediction = predict_batcher.submit((loaded, input_data), timeout=deadline.remaining())
+                    except FutureTimeoutError:
+                        raise DeadlineExceeded(stage)
+            elif loaded.compiled is not None:
+                stage = 'prepare'
+                deadline.check(stage)
+                with PREDICT_STAGE_SECONDS.time(stage):
+                    features = loaded.compiled.preparer.transform(input_data)
+                stage = 'predict'
+                deadline.check(stage)
+                with PREDICT_STAGE_SECONDS.time(stage):
+                    prediction = loaded.compiled.pipeline.predict(features)
+            else:
+                prediction = predict_with_pandas(loaded, input_data, deadline)
+            if use_cache:
+                prediction_cache.put(cache_key, prediction, loaded.version)
 
         output = round(prediction, 2)
+        log_prediction(input_data, loaded, prediction=output)
 
         return jsonify(prediction=f'Predicted Price: {output}')
+    except DeadlineExceeded:
+        raise
     except Exception as e:
+        PREDICT_ERRORS.inc(getattr(e, 'stage', stage))
         print(f"Error during prediction: {e}")
-        return jsonify(prediction=f"Error during prediction: {e}")
+        log_prediction(input_data, loaded, error=str(e))
+        return jsonify(prediction=f"Error during prediction: {e}"), 500
+
+def predict_with_pandas(loaded, input_data, deadline=None):
+    # The DataFrame path, for pipelines that cannot be compiled
+    deadline = deadline or Deadline()
+    stage = 'build_frame'
+    try:
+        with PREDICT_STAGE_SECONDS.time(stage):
+            input_df = build_input_frame(input_data)
+        stage = 'prepare'
+        deadline.check(stage)
+        with PREDICT_STAGE_SECONDS.time(stage):
+            prepared_data = loaded.preparer.transform(input_df)
+        stage = 'transform'
+        deadline.check(stage)
+        with PREDICT_STAGE_SECONDS.time(stage):
+            processed_data = loaded.pipeline.named_steps['preprocessor'].transform(prepared_data)
+        stage = 'predict'
+        deadline.check(stage)
+        with PREDICT_STAGE_SECONDS.time(stage):
+            return loaded.pipeline.named_steps['model'].predict(processed_data)[0]
+    except Exception as e:
+        e.stage = stage
+        raise
+
+# The nearest-neighbour index of the training listings written by model_training.py next to the model
+COMPARABLES_PATH = os.environ.get('COMPARABLES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'comparables.pkl'))
+COMPARABLES_DEFAULT_K = int(os.environ.get('COMPARABLES_DEFAULT_K', 5))
+COMPARABLES_MAX_K = int(os.environ.get('COMPARABLES_MAX_K', 50))
+
+# The loaded index and the mtime of its file, reloaded when training writes a new one
+comparables_index = {'index': None, 'mtime': None}
+comparables_lock = threading.Lock()
+
+def load_comparables():
+    try:
+        mtime = os.stat(COMPARABLES_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with comparables_lock:
+        if comparables_index['mtime'] != mtime:
+            with open(COMPARABLES_PATH, 'rb') as f:
+                comparables_index['index'] = pickle.load(f)
+            comparables_index['mtime'] = mtime
+        return comparables_index['index']
+
+@app.route('/comparables', methods=['POST'])
+def comparables():
+    # The same fields as /predict; k is the number of listings to return
+    try:
+        data = request.get_json(silent=True) if request.is_json else request.form
+        input_data = parse_car(data).as_dict()
+    except InvalidRequest as e:
+        return jsonify(error=f"Invalid input: {e}", errors=e.errors), 400
+    k = request.args.get('k', COMPARABLES_DEFAULT_K, type=int)
+    if not 1 <= k <= COMPARABLES_MAX_K:
+        return jsonify(error=f"k must be between 1 and {COMPARABLES_MAX_K}"), 400
+
+    index = load_comparables()
+    if index is None:
+        return jsonify(error="Comparables index not found, run model_training.py"), 503
+    loaded = registry.current()
+
+    try:
+        # The car is filled and cleaned like the listings of the index, and predicted on the way
+        if loaded.compiled is not None:
+            features = loaded.compiled.preparer.transform(input_data)
+            prediction = loaded.compiled.pipeline.predict(features)
+        else:
+            features = loaded.preparer.transform(build_input_frame(input_data)).iloc[0].to_dict()
+            prediction = predict_with_pandas(loaded, input_data)
+        # The index compares odometer readings, which the preparation replaces with a value derived from the year
+        level, listings = index.query(dict(features, Km=input_data['Km']), k=k)
+    except (RowDroppedError, ValueError) as e:
+        return jsonify(error=f"Invalid input: {e}"), 400
+
+    return jsonify(prediction=round(float(prediction), 2), level=level, comparables=listings)
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(prediction_cache.stats(), **dict(worker_label())))
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    IN_FLIGHT.inc()
+
+@app.after_request
+def count_request(response):
+    REQUESTS.inc(request.url_rule.rule if request.url_rule else 'unmatched', response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Runs after a streamed response has been sent
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, request.url_rule.rule if request.url_rule else 'unmatched')
+        IN_FLIGHT.dec()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(worker_label()), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def check_admin_token():
+    # The server listens on all interfaces, so the admin endpoints always need the token
+    if request.path.startswith('/admin/') and (not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN):
+        return jsonify(error="Forbidden"), 403
+
+@app.route('/admin/models')
+def list_models():
+    return jsonify(dict(registry.describe(), **dict(worker_label())))
+
+@app.route('/admin/models/reload', methods=['POST'])
+def reload_model():
+    if master_pid:
+        # Under serve.py the master reloads the model and replaces all the workers one at a time
+        os.kill(master_pid, signal.SIGHUP)
+        return jsonify(status="reloading", scope="all workers"), 202
+    # The new model is loaded and warmed up in the background unless the caller waits for it
+    if request.args.get('wait'):
+        try:
+            loaded = registry.load()
+        except Exception as e:
+            return jsonify(error=f"Error loading model: {e}"), 500
+        return jsonify(version=loaded.version)
+    registry.reload_in_background()
+    return jsonify(status="reloading"), 202
+
+@app.route('/admin/models/pin', methods=['POST'])
+def pin_model():
+    if master_pid:
+        return pinning_refused()
+    version = (request.get_json(silent=True) or request.form).get('version')
+    try:
+        registry.pin(version)
+    except KeyError:
+        return jsonify(error=f"Unknown model version: {version}"), 404
+    return jsonify(registry.describe())
+
+@app.route('/admin/models/unpin', methods=['POST'])
+def unpin_model():
+    if master_pid:
+        return pinning_refused()
+    registry.unpin()
+    return jsonify(registry.describe())
+
+def pinning_refused():
+    # A pin would only reach the worker that got the request
+    return jsonify(error="Pinning is per process and not available under serve.py; put the model to roll back "
+                         "to at MODEL_PATH and POST /admin/models/reload"), 409
 
 if __name__ == "__main__":
+    # Development server; production traffic is served by serve.py
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG', '1') == '1')
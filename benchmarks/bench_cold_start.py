@@ -0,0 +1,82 @@
+"""Cold start of an API worker: time from a fresh interpreter to the first prediction.
+
+Each run is a new Python process that imports api, loads the model and
+answers one /predict request; the median of the runs is reported for the
+pickled artifact and for the compact one written by
+`python model_training.py --export`:
+
+    python benchmarks/bench_cold_start.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process and prints its timings as JSON
+CHILD = """
+import time
+start = time.perf_counter()
+import sys
+sys.path.insert(0, {root!r})
+import api
+imported = time.perf_counter()
+api.registry.current()
+loaded = time.perf_counter()
+response = api.app.test_client().post('/predict', data=api.WARMUP_CAR)
+predicted = time.perf_counter()
+import json
+print(json.dumps({{
+    'import_s': imported - start,
+    'load_s': loaded - imported,
+    'first_predict_s': predicted - loaded,
+    'total_s': predicted - start,
+    'prediction': response.get_json()['prediction'],
+    'heavy_modules': sorted(name for name in ['pandas', 'sklearn', 'scipy', 'numpy'] if name in sys.modules),
+}}))
+"""
+
+
+def cold_start(model_path, runs):
+    # Synthetic requests stay out of the request log
+    env = dict(os.environ, MODEL_PATH=model_path, PREDICT_CACHE_SIZE='0', REQUEST_LOG_PATH='')
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT)], env=env, cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    result = {name: round(statistics.median(sample[name] for sample in samples), 4)
+              for name in ['import_s', 'load_s', 'first_predict_s', 'total_s']}
+    result['prediction'] = samples[-1]['prediction']
+    result['heavy_modules'] = samples[-1]['heavy_modules']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--pickle', default=os.path.join(ROOT, 'trained_model.pkl'))
+    parser.add_argument('--compact', default=os.path.join(ROOT, 'trained_model.compact'))
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, path in [('pickle', args.pickle), ('compact', args.compact)]:
+        if not os.path.exists(path):
+            print(f"{name:<8} {path} not found")
+            continue
+        results[name] = result = cold_start(path, args.runs)
+        print(f"{name:<8} import {result['import_s'] * 1000:7.1f} ms  load {result['load_s'] * 1000:7.1f} ms  "
+              f"first predict {result['first_predict_s'] * 1000:6.1f} ms  total {result['total_s'] * 1000:7.1f} ms  "
+              f"imports {', '.join(result['heavy_modules']) or '-'}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Throughput of the data preparation and latency of /predict.
+
+Prepares synthetic datasets resampled from dataset.csv and drives /predict
+through the Flask test client at several concurrency levels, then writes
+the results as JSON. With --baseline, every metric is compared with a
+stored run and the exit code is 1 when one regressed past --threshold:
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --threshold 0.2
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Measure the prediction path, not cache hits; set before api is imported
+os.environ['PREDICT_CACHE_SIZE'] = '0'
+# Synthetic requests stay out of the request log
+os.environ['REQUEST_LOG_PATH'] = ''
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from car_data_prep import DataPreparer
+
+FORM_FIELDS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type',
+               'Prev_ownership', 'Curr_ownership', 'Description', 'Km', 'Test']
+
+
+def synthetic_dataset(rows, seed=0):
+    # Rows resampled with replacement, so any size keeps the value distribution of dataset.csv
+    data = pd.read_csv(os.path.join(ROOT, 'dataset.csv'))
+    return data.sample(rows, replace=True, random_state=seed).reset_index(drop=True)
+
+
+def bench_prepare(rows, repeats):
+    data = synthetic_dataset(rows)
+    result = {}
+    for mode in ['fit_transform', 'transform']:
+        best_seconds, best_timings = None, None
+        preparer = DataPreparer().fit(data.copy()) if mode == 'transform' else None
+        # The fastest of the repeats is the least disturbed by the rest of the machine
+        for _ in range(repeats):
+            frame = data.copy()
+            timings = {}
+            start = time.perf_counter()
+            if mode == 'fit_transform':
+                DataPreparer().fit_transform(frame, timings)
+            else:
+                preparer.transform(frame, timings)
+            seconds = time.perf_counter() - start
+            if best_seconds is None or seconds < best_seconds:
+                best_seconds, best_timings = seconds, timings
+        result[mode] = {
+            'seconds': round(best_seconds, 4),
+            'rows_per_sec': round(rows / best_seconds, 1),
+            'stages': {name: {'seconds': round(seconds, 4), 'rows_per_sec': round(rows / seconds, 1) if seconds else None}
+                       for name, seconds in best_timings.items()},
+        }
+    return result
+
+
+def form_records(count):
+    data = pd.read_csv(os.path.join(ROOT, 'dataset.csv'))
+    rows = data.sample(count, replace=True, random_state=1)
+    return [{field: '' if pd.isna(row[field]) else str(row[field]) for field in FORM_FIELDS}
+            for _, row in rows.iterrows()]
+
+
+def bench_predict(concurrency, requests_per_level):
+    import api
+    # Load and warm up the model before anything is measured
+    api.registry.current()
+    records = form_records(requests_per_level)
+    result = {}
+    for threads in concurrency:
+        latencies = [[] for _ in range(threads)]
+        errors = [0] * threads
+
+        def work(worker):
+            client = api.app.test_client()
+            for record in records[worker::threads]:
+                start = time.perf_counter()
+                response = client.post('/predict', data=record)
+                latencies[worker].append(time.perf_counter() - start)
+                # Dataset rows the preparation drops (no usable Km) are answered with an error message
+                if response.status_code != 200 or 'Predicted Price' not in response.get_json()['prediction']:
+                    errors[worker] += 1
+
+        workers = [threading.Thread(target=work, args=(worker,)) for worker in range(threads)]
+        # The API prints every failed prediction
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            seconds = time.perf_counter() - start
+
+        all_latencies = np.concatenate([np.array(worker_latencies) for worker_latencies in latencies]) * 1000
+        result[str(threads)] = {
+            'requests': int(all_latencies.size),
+            'errors': sum(errors),
+            'req_per_sec': round(all_latencies.size / seconds, 1),
+            'p50_ms': round(float(np.percentile(all_latencies, 50)), 3),
+            'p95_ms': round(float(np.percentile(all_latencies, 95)), 3),
+            'p99_ms': round(float(np.percentile(all_latencies, 99)), 3),
+        }
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def flatten(results):
+    # Comparable metrics with the direction in which they get better
+    metrics = {}
+    for rows, modes in results['prepare'].items():
+        for mode, result in modes.items():
+            metrics[f'prepare.{rows}.{mode}.rows_per_sec'] = (result['rows_per_sec'], 'higher')
+            for stage, stage_result in result['stages'].items():
+                if stage_result['rows_per_sec']:
+                    metrics[f'prepare.{rows}.{mode}.{stage}.rows_per_sec'] = (stage_result['rows_per_sec'], 'higher')
+    for threads, result in results['predict'].items():
+        metrics[f'predict.{threads}.req_per_sec'] = (result['req_per_sec'], 'higher')
+        for percentile in ['p50_ms', 'p95_ms', 'p99_ms']:
+            metrics[f'predict.{threads}.{percentile}'] = (result[percentile], 'lower')
+    return metrics
+
+
+def compare(results, baseline, threshold):
+    # The metrics that got worse than the baseline by more than the threshold
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for name, (value, better) in current.items():
+        if name not in previous or not previous[name][0]:
+            continue
+        change = (value - previous[name][0]) / previous[name][0]
+        if (better == 'higher' and change < -threshold) or (better == 'lower' and change > threshold):
+            regressions.append((name, previous[name][0], value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=3, help="runs per prepare benchmark, the fastest is kept")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=2000, help="/predict requests per concurrency level")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with the results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument('--save-baseline', metavar='PATH', help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'prepare': {}, 'predict': {}}
+    for rows in args.sizes:
+        results['prepare'][str(rows)] = bench_prepare(rows, args.repeats if rows < 1000000 else 1)
+        for mode, result in results['prepare'][str(rows)].items():
+            print(f"prepare {rows:>8} rows {mode:<14} {result['rows_per_sec']:>12,.0f} rows/s")
+    results['predict'] = bench_predict(args.concurrency, args.requests)
+    for threads, result in results['predict'].items():
+        print(f"/predict {threads:>3} threads {result['req_per_sec']:>8} req/s  p50 {result['p50_ms']} ms  "
+              f"p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  errors {result['errors']}")
+
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, previous, value, change in regressions:
+            print(f"REGRESSION {name}: {previous} -> {value} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression past {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Requests per second of serve.py for a growing number of worker processes.
+
+Starts serve.py once per worker count, drives /predict with keep-alive
+clients running in their own processes and prints the throughput and
+latency percentiles of each run:
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --clients 16 --duration 10
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORM_FIELDS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type',
+               'Prev_ownership', 'Curr_ownership', 'Description', 'Km', 'Test']
+
+
+def load_bodies(count):
+    # Form bodies built from dataset rows, so the requests are as varied as real ones
+    data = pd.read_csv(os.path.join(ROOT, 'dataset.csv'))
+    rows = data.sample(min(count, len(data)), random_state=0)
+    bodies = []
+    for _, row in rows.iterrows():
+        form = {field: '' if pd.isna(row[field]) else str(row[field]) for field in FORM_FIELDS}
+        bodies.append(urllib.parse.urlencode(form).encode())
+    return bodies
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/cache/stats')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("serve.py did not start in time")
+
+
+def run_client(args):
+    port, bodies, duration = args
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request('POST', '/predict', body=bodies[i % len(bodies)], headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    connection.close()
+    return latencies, errors
+
+
+def bench(workers, clients, duration, bodies, env):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py')],
+        env=dict(env, HOST='127.0.0.1', PORT=str(port), WEB_WORKERS=str(workers)),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port, process)
+        # Each client starts at a different body
+        jobs = [(port, bodies[i::clients] or bodies, duration) for i in range(clients)]
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(run_client, jobs)
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = pd.Series([latency for client, _ in results for latency in client])
+    return {
+        'workers': workers,
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'req_per_sec': round(len(latencies) / duration, 1),
+        'p50_ms': round(latencies.quantile(0.5) * 1000, 2),
+        'p99_ms': round(latencies.quantile(0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--cache', action='store_true', help="keep the prediction cache on")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    bodies = load_bodies(2000)
+    # Synthetic requests stay out of the request log
+    env = dict(os.environ, REQUEST_LOG_PATH='')
+    if not args.cache:
+        # Measure the prediction path, not cache hits
+        env['PREDICT_CACHE_SIZE'] = '0'
+
+    results = []
+    for workers in args.workers:
+        result = bench(workers, args.clients, args.duration, bodies, env)
+        results.append(result)
+        if not args.json:
+            print(f"{result['workers']:>3} workers: {result['req_per_sec']:>8} req/s  "
+                  f"p50 {result['p50_ms']:>7} ms  p99 {result['p99_ms']:>7} ms  errors {result['errors']}")
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
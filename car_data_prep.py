@@ -1,349 +1,630 @@
 import pandas as pd
+import contextlib
+import itertools
+import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import numpy as np
+from description_matcher import DescriptionMatcher
+
+# Columns that are never used by the model
+COLUMNS_TO_DROP = ['Area', 'City', 'Pic_num', 'Cre_date', 'Repub_date', 'Color']
+
+# Ownership ranking dictionary
+OWNERSHIP_RANKING = {
+    'מונית': 1,
+    'לימוד נהיגה': 2,
+    'השכרה': 3,
+    'ליסינג': 4,
+    'פרטית': 5,
+    'ייבוא אישי': 6,
+    'ממשלתי': 7
+}
+
+# Inconsistent values in the 'model' column
+MODEL_REPLACEMENTS = {
+    "קאונטרימן": "קאנטרימן",
+    "גראנד, וויאגר": "גראנד, וויאג'ר",
+    "גטה": "ג'טה",
+    "גאז": "ג'אז",
+    "C-Class קופה": "C-CLASS קופה",
+    "E-CLASS": "E-Class",
+    "E- CLASS": "E-Class"
+}
+
+# Inconsistent values in the 'Gear', 'Engine_type' and 'manufactor' columns
+GEAR_REPLACEMENTS = {"אוטומט": "אוטומטית"}
+ENGINE_TYPE_REPLACEMENTS = {"היבריד": "היברידי"}
+MANUFACTOR_REPLACEMENTS = {"Lexsus": "לקסוס"}
+
+# Values considered as "undefined"
+UNDEFINED_GEAR = 'לא מוגדר'
+UNDEFINED_OWNERSHIP = ['None', 'לא מוגדר', 'אחר']
+
+# Columns read as text; pandas guesses the type of a column separately for each chunk of a CSV,
+# so a chunk where every model is a number (Mazda 3, Peugeot 208) would otherwise get int models
+TEXT_COLUMNS = ['manufactor', 'model', 'Gear', 'Engine_type', 'Prev_ownership', 'Curr_ownership',
+                'Area', 'City', 'Cre_date', 'Repub_date', 'Description', 'Color', 'Test']
+TEXT_DTYPES = {column: str for column in TEXT_COLUMNS}
+
+# Columns that can be filled from the description
+DESCRIPTION_COLUMNS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type']
+
+
+def _mode_or_none(values):
+    mode = values.mode()
+    return mode[0] if not mode.empty else None
+
+
+# The stages of the preparation grouped into the steps of a timing report
+TIMING_GROUPS = {
+    'read': ['read_csv'],
+    'drop': ['drop_columns', 'drop_sparse_columns', 'drop_ownership_columns'],
+    'model_cleanup': ['clean_model', 'replace_values'],
+    'description': ['build_matcher', 'fill_from_description'],
+    'imputation': ['fill_year_and_hand', 'fill_gear', 'fill_capacity_engine', 'fill_engine_type'],
+    'km': ['derive_km', 'clean_km'],
+    'ownership': ['combine_ownership'],
+    'statistics': ['fit_statistics'],
+}
+
+
+def _add_timing(timings, name, start):
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _timed(timings, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    _add_timing(timings, name, start)
+    return result
+
+
+def _read_chunks(path, chunksize, timings, **read_csv_kwargs):
+    # The chunks of a CSV, with the time spent reading them added to timings
+    read_csv_kwargs['dtype'] = {**TEXT_DTYPES, **read_csv_kwargs.get('dtype', {})}
+    reader = pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs)
+    while True:
+        chunk = _timed(timings, 'read_csv', next, reader, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def timing_report(timings, rows):
+    # Seconds, share of the total and rows/sec of each step, with the stages it is made of
+    total = sum(timings.values())
+    groups = {}
+    for group, stages in TIMING_GROUPS.items():
+        stage_seconds = {stage: timings[stage] for stage in stages if stage in timings}
+        if stage_seconds:
+            groups[group] = stage_seconds
+    grouped = {stage for stages in groups.values() for stage in stages}
+    other = {stage: seconds for stage, seconds in timings.items() if stage not in grouped}
+    if other:
+        groups['other'] = other
+
+    report = {'rows': rows, 'seconds': round(total, 4), 'steps': {}}
+    for group, stage_seconds in groups.items():
+        seconds = sum(stage_seconds.values())
+        report['steps'][group] = {
+            'seconds': round(seconds, 4),
+            'share': round(seconds / total, 4) if total else 0.0,
+            'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+            'stages': {stage: round(value, 4) for stage, value in stage_seconds.items()},
+        }
+    return report
+
+
+def _sum_from_counts(counts):
+    # Summed in the order of the values, so the result does not depend on the order of the rows
+    return float(sum(value * count for value, count in sorted(counts.items())))
+
+
+def _mean_from_counts(counts):
+    return _sum_from_counts(counts) / sum(counts.values())
+
+
+def _distinct_values(*columns):
+    # The code of each row and the distinct combinations of values in the columns (NaN included)
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    uniques_by_column = []
+    for column in columns:
+        column_codes, uniques = pd.factorize(column, use_na_sentinel=False)
+        codes = codes * len(uniques) + column_codes
+        uniques_by_column.append(uniques)
+    row_codes, distinct_codes = pd.factorize(codes)
 
-def prepare_data(df):
-    # Columns to drop
-    columns_to_drop = ['Area', 'City', 'Pic_num', 'Cre_date', 'Repub_date', 'Color']
-    df_dropped = df.drop(columns=columns_to_drop)
-    
-    # Standardize data by removing the 'manufactor' word from 'model' and removing years (numbers in parentheses)
-    df_dropped['model'] = df_dropped.apply(lambda row: re.sub(r'\(\d{4}\)', '', row['model'].replace(row['manufactor'], '').strip()).strip(), axis=1)
-    
-    # Function to extract information from the 'Description' column
-    def extract_info(description, unique_manufactors, unique_models):
-        info = {}
-        
-        # Extract manufactor
-        for manufactor in unique_manufactors:
-            if re.search(manufactor, description):
-                info['manufactor'] = manufactor
-        
-        # Extract Year
-        year_match = re.search(r'שנה\s(198[0-9]|199[0-9]|200[0-9]|201[0-9]|202[0-4])\b', description)
-        if year_match:
-            info['Year'] = int(year_match.group(1))
-        
-        # Extract model
-        for model in unique_models:
-            if re.search(model, description, re.IGNORECASE):
-                info['model'] = model
-        
-        # Extract Hand
-        hand_match = re.search(r'\b(\d+)\s*יד\b', description)
-        if hand_match:
-            info['Hand'] = int(hand_match.group(1))
-        
-        # Extract Gear
-        gears = ['אוטומטית', 'טיפטרוניק', 'ידנית', 'רובוטית', 'אוטומט', 'לא מוגדר']
-        for gear in gears:
-            if re.search(gear, description, re.IGNORECASE):
-                info['Gear'] = gear
-                break
-        
-        # Extract capacity_Engine
-        capacity_engine_match = re.search(r'(?:(?:נפח|מנוע|נפח מנוע)\s*(\d+))', description)
-        if capacity_engine_match:
-            info['capacity_Engine'] = int(capacity_engine_match.group(1))
-        
-        # Extract Engine_type
-        engine_types = ['בנזין', 'דיזל', 'גז', 'היברידי', 'היבריד', 'טורבו דיזל', 'חשמלי']
-        for engine_type in engine_types:
-            if re.search(engine_type, description, re.IGNORECASE):
-                info['Engine_type'] = engine_type
-                break
-        
-        return info
-
-    def update_missing_values(row, columns_options, ownership_pattern):
-        for column, options in columns_options.items():
-            if pd.isna(row[column]):
-                for option in options:
-                    if option in row["Description"]:
-                        if column == "Gear" and option in ["אוטומט", "אוטומטי"]:
-                            row[column] = "אוטומטית"
-                        elif column == "Engine_type":
-                            if option == "היברידית":
-                                row[column] = "היברידי"
-                            elif option == "חשמלית":
-                                row[column] = "חשמלי"
-                            else:
-                                row[column] = option
-                        else:
-                            row[column] = option
-                        break
-        
-        # Update Prev_ownership and Curr_ownership if missing
-        if pd.isna(row['Prev_ownership']) or pd.isna(row['Curr_ownership']):
-            ownership_from_desc = find_ownership(row['Description'])
-            if ownership_from_desc:
-                if pd.isna(row['Prev_ownership']):
-                    row['Prev_ownership'] = ownership_from_desc
-                if pd.isna(row['Curr_ownership']):
-                    row['Curr_ownership'] = ownership_from_desc
-        
-        return row
-
-    def find_ownership(description):
-        if pd.isna(description):
-            return None
-        match = re.search(ownership_pattern, description)
-        if match:
-            return match.group(0)
-        return None
+    distinct = []
+    for code in distinct_codes:
+        values = []
+        for uniques in reversed(uniques_by_column):
+            code, position = divmod(code, len(uniques))
+            values.append(uniques[position])
+        distinct.append(tuple(reversed(values)))
+    return row_codes, distinct
 
-    def fill_values_from_description(df, unique_manufactors, unique_models, columns_options, ownership_pattern):
-        for index, row in df.iterrows():
-            if pd.notnull(row['Description']):
-                extracted_info = extract_info(row['Description'], unique_manufactors, unique_models)
-                for key, value in extracted_info.items():
-                    if pd.isnull(row[key]):
-                        df.at[index, key] = value
-            update_missing_values(row, columns_options, ownership_pattern)
-        return df
 
-    # Define unique manufactors and models for extraction
-    unique_manufactors = df['manufactor'].unique()
-    unique_models = df['model'].unique()
-
-    # Define columns options for missing values update
-    columns_options = {
-        'Gear': ['אוטומט', 'אוטומטי', 'ידני', 'רובוטי'],
-        'Engine_type': ['בנזין', 'דיזל', 'היברידית', 'חשמלית']
-    }
-
-    # Define ownership pattern
-    ownership_pattern = r'יד \d'
-    
-    # Define ownership types
-    ownership_types = ['פרטית', 'השכרה', 'ליסינג', 'מונית', 'לימוד נהיגה', 'ייבוא אישי', 'ממשלתי']
-    
-    # Create ownership pattern
-    ownership_pattern = '|'.join(ownership_types)
-    
-    # List of rows where missing values were completed
-    completed_rows = []
-    
-    # Fill missing values in Prev_ownership and Curr_ownership
-    for index, row in df_dropped.iterrows():
-        if pd.isna(row['Prev_ownership']) or pd.isna(row['Curr_ownership']):
-            ownership_from_desc = find_ownership(row['Description'])
-            if ownership_from_desc:
-                if pd.isna(row['Prev_ownership']):
-                    df_dropped.at[index, 'Prev_ownership'] = ownership_from_desc
-                if pd.isna(row['Curr_ownership']):
-                    df_dropped.at[index, 'Curr_ownership'] = ownership_from_desc
-                completed_rows.append(index)
-
-    # Fill values from description
-    df_dropped = fill_values_from_description(df_dropped, unique_manufactors, unique_models, columns_options, ownership_pattern)
-
-    # Count missing values in each column
-    missing_values = df_dropped.isnull().sum()
-    
-    # Calculate the percentage of missing values
-    missing_percentage = (missing_values / len(df_dropped)) * 100
-    
-    # Create a DataFrame to display the results more nicely
-    missing_values_df = pd.DataFrame({'Missing Values': missing_values, 'Percentage': missing_percentage})
-    
-    # Filter columns with more than 50% missing values
-    columns_to_drop = missing_percentage[missing_percentage > 50].index
-    
-    # Drop the columns from df_dropped
-    df_dropped = df_dropped.drop(columns=columns_to_drop)
-    
-    # Replace inconsistent values in 'model' column
-    df_dropped['model'] = df_dropped['model'].replace({
-        "קאונטרימן": "קאנטרימן",
-        "גראנד, וויאגר": "גראנד, וויאג'ר",
-        "גטה": "ג'טה",
-        "גאז": "ג'אז",
-        "C-Class קופה": "C-CLASS קופה",
-        "E-CLASS": "E-Class",
-        "E- CLASS": "E-Class"
-    })
-    
-    # Replace inconsistent values in 'Gear' column
-    df_dropped['Gear'] = df_dropped['Gear'].replace("אוטומט", "אוטומטית")
-    
-    # Replace inconsistent values in 'Engine_type' column
-    df_dropped['Engine_type'] = df_dropped['Engine_type'].replace("היבריד", "היברידי")
-    
-    # Replace inconsistent values in 'manufactor' column
-    df_dropped["manufactor"] = df_dropped["manufactor"].replace("Lexsus", "לקסוס")
-    
-    # Fill missing values in Year and Hand columns
-    
-    # Add a column Years_Since_Year indicating the number of years the car has been on the road
-    current_year = datetime.now().year
-    df_dropped['Years_Since_Year'] = current_year - df_dropped['Year']
-    
-    # Step 1: Find rows with no missing values in Hand and Years_Since_Year columns
-    valid_rows = df_dropped.dropna(subset=['Hand', 'Years_Since_Year'])
-    
-    # Step 2: Calculate the ratio and mean ratio
-    ratios = valid_rows['Years_Since_Year'] / valid_rows['Hand']
-    mean_ratio = ratios.mean()
-    
-    # Step 3: Fill missing values in Hand column
-    df_dropped['Hand'] = df_dropped.apply(
-        lambda row: row['Years_Since_Year'] / mean_ratio if pd.isnull(row['Hand']) else row['Hand'],
-        axis=1
-    )
-    
-    # Step 4: Fill missing values in Years_Since_Year and Year columns
-    df_dropped['Years_Since_Year'] = df_dropped.apply(
-        lambda row: row['Hand'] * mean_ratio if pd.isnull(row['Years_Since_Year']) else row['Years_Since_Year'],
-        axis=1
-    )
-    df_dropped['Year'] = df_dropped.apply(
-        lambda row: current_year - row['Years_Since_Year'] if pd.isnull(row['Year']) else row['Year'],
-        axis=1
-    )
-    
-    # Fill missing values in Gear column
-    
-    # Create a dictionary with the most common values in the Gear column by year
-    gear_mode_by_year = df_dropped.groupby('Year')['Gear'].agg(lambda x: x.mode()[0] if not x.mode().empty else None).to_dict()
-
-    # Define a set of values considered as "undefined"
-    undefined_values = {'לא מוגדר', None, np.nan}
-
-    # Fill missing values and undefined values in Gear column according to the gear_mode_by_year dictionary
-    df_dropped['Gear'] = df_dropped.apply(
-        lambda row: gear_mode_by_year[row['Year']] if row['Gear'] in undefined_values else row['Gear'],
-        axis=1
-    )
-
-    # Fill missing values in capacity_Engine column
-
-    # Convert 'capacity_Engine' column to numeric, setting errors='coerce' to convert invalid parsing to NaN
-    df_dropped['capacity_Engine'] = pd.to_numeric(df_dropped['capacity_Engine'], errors='coerce')
-
-    # Replace empty string values with NaN
-    df_dropped['capacity_Engine'] = df_dropped['capacity_Engine'].replace('', pd.NA)
-
-    # Check for NaN values in 'capacity_Engine' column
-    missing_values_before = df_dropped['capacity_Engine'].isna().sum()
-
-    # Calculate the median value
-    median_capacity = df_dropped['capacity_Engine'].median()
-
-    # Replace NaN values with the median value
-    df_dropped['capacity_Engine'] = df_dropped['capacity_Engine'].fillna(median_capacity)
-
-    # Check for NaN values after filling
-    missing_values_after = df_dropped['capacity_Engine'].isna().sum()
-
-    # Identify outliers using IQR
-    Q1 = df_dropped['capacity_Engine'].quantile(0.25)
-    Q3 = df_dropped['capacity_Engine'].quantile(0.75)
-    IQR = Q3 - Q1
-
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-
-    # Handle outliers without changing other data
-    df_dropped['capacity_Engine'] = df_dropped['capacity_Engine'].apply(lambda x: lower_bound if x < lower_bound else (upper_bound if x > upper_bound else x))
-
-    # Calculate statistical data for the 'capacity_Engine' column after handling outliers
-    capacity_engine_stats = df_dropped['capacity_Engine'].describe(percentiles=[.25, .5, .75])
-
-    # Fill missing values in capacity_Engine column
-    
-    # Convert 'capacity_Engine' column to numeric
-    df_dropped['capacity_Engine'] = pd.to_numeric(df_dropped['capacity_Engine'], errors='coerce')
-    
-    # Convert non-numeric values in the 'capacity_Engine' column to numeric, setting errors='coerce' to convert invalid parsing to NaN
-    df['capacity_Engine'] = pd.to_numeric(df['capacity_Engine'], errors='coerce')
-
-    # Replace NaN values with the median value
-    median_capacity = df['capacity_Engine'].median()
-    df['capacity_Engine'] = df['capacity_Engine'].fillna(median_capacity)
-    
-    # Fill missing values in Engine_type column
-    
-    # Create a dictionary with the most common values in the Engine_type column by manufactor
-    engine_type_mode_by_manufactor = df_dropped.groupby('manufactor')['Engine_type'].agg(lambda x: x.mode()[0] if not x.mode().empty else None).to_dict()
-    
-    # Fill missing values in Engine_type column according to the engine_type_mode_by_manufactor dictionary
-    df_dropped['Engine_type'] = df_dropped.apply(lambda row: engine_type_mode_by_manufactor[row['manufactor']] if pd.isnull(row['Engine_type']) else row['Engine_type'], axis=1)
-
-    # Convert 'Km' column to string to use .str accessor
-    df_dropped['Km'] = df_dropped['Km'].astype(str)
-
-    # Remove commas and replace 'None' with NaN
-    df_dropped['Km'] = df_dropped['Km'].str.replace(',', '').replace('None', np.nan)
-
-    # Remove rows with non-convertible values
-    df_dropped = df_dropped[pd.to_numeric(df_dropped['Km'], errors='coerce').notnull()]
-
-    # Convert to float and then to int
-    df_dropped['Km'] = df_dropped['Km'].astype(float).astype(int)
-
-    # Fill missing values in 'Km' column with 0
-    df_dropped['Km'] = df_dropped['Km'].fillna(0).astype(int)
-
-    # Remove rows with Km value of 1000000
-    df_dropped = df_dropped[df_dropped['Km'] != 1000000]
-
-    # Multiply values less than 500 by 1000
-    df_dropped.loc[df_dropped['Km'] < 500, 'Km'] *= 1000
-
-    # Filter out 0 values and missing values in 'Km' column
-    filtered_km = df_dropped[df_dropped['Km'] != 0]['Km']
-
-    # Calculate the sum of values in 'Km' column after filtering
-    sum_km = filtered_km.sum()
-
-    # Calculate the sum of the difference in years
-    sum_year_difference = df_dropped['Years_Since_Year'].sum()
-
-    # Calculate new values in 'Km' column based on the requested formula
-    df_dropped['Km'] = df_dropped.apply(lambda row: sum_km / sum_year_difference * row['Years_Since_Year'], axis=1)
-
-    # Convert 'Km' column to string
-    df_dropped['Km'] = df_dropped['Km'].astype(str)
-
-    # Remove 'Years_Since_Year' column
-    df_dropped.drop(columns=['Years_Since_Year'], inplace=True)
-    
-    # Ownership ranking dictionary
-    ownership_ranking = {
-        'מונית': 1,
-        'לימוד נהיגה': 2,
-        'השכרה': 3,
-        'ליסינג': 4,
-        'פרטית': 5,
-        'ייבוא אישי': 6,
-        'ממשלתי': 7
-    }
-
-    # Function to combine ownership values based on specified conditions
-    def combine_ownership(prev, curr):
-        if pd.isna(prev) and pd.isna(curr):
-            return None
-        if pd.isna(prev):
-            return curr
-        if pd.isna(curr):
-            return prev
-        if prev == curr:
-            return prev
-        return prev if ownership_ranking.get(prev, float('inf')) < ownership_ranking.get(curr, float('inf')) else curr
-
-    # Combine the columns
-    df_dropped['ownership'] = df_dropped.apply(lambda row: combine_ownership(row['Prev_ownership'], row['Curr_ownership']), axis=1)
+def _map_back(results, row_codes, index):
+    # The rows share one object per distinct result
+    array = np.empty(len(results), dtype=object)
+    for i, result in enumerate(results):
+        array[i] = result
+    return pd.Series(array[row_codes], index=index, dtype=object)
+
+
+def _map_distinct(func, *columns):
+    # func is called once per distinct combination of values in the columns and the results are mapped back to the rows
+    row_codes, distinct = _distinct_values(*columns)
+    return _map_back([func(*values) for values in distinct], row_codes, columns[0].index)
+
+
+# Distinct descriptions per task of the parallel description pass; fewer than this are matched in-process
+DESCRIPTION_TASK_SIZE = 2000
+
+# The description matcher of a worker process of the parallel description pass
+_worker_matcher = None
+
+
+def _init_description_worker(unique_manufactors, unique_models):
+    # The vocabularies are sent once per worker, which compiles its own matcher
+    global _worker_matcher
+    _worker_matcher = DescriptionMatcher(unique_manufactors, unique_models)
+
+
+def _match_descriptions(method, descriptions):
+    match = getattr(_worker_matcher, method)
+    return [match(description) for description in descriptions]
+
+
+def _resolve_jobs(n_jobs):
+    # None or 1 is serial, -1 is every core
+    if n_jobs is None:
+        return 1
+    return os.cpu_count() or 1 if n_jobs < 0 else n_jobs
+
+
+def _clean_model_name(manufactor, model):
+    # Remove the 'manufactor' word from 'model' and years (numbers in parentheses)
+    return re.sub(r'\(\d{4}\)', '', model.replace(manufactor, '').strip()).strip()
+
+
+def _combined_ownership(prev, curr):
+    # Keep the value with the lower rank when the columns differ
+    if pd.isna(prev):
+        ownership = curr
+    elif pd.isna(curr) or prev == curr:
+        ownership = prev
+    else:
+        ownership = prev if OWNERSHIP_RANKING.get(prev, np.inf) < OWNERSHIP_RANKING.get(curr, np.inf) else curr
 
     # Replace certain values with NaN
-    df_dropped['ownership'].replace(['None', 'לא מוגדר', 'אחר'], pd.NA, inplace=True)
+    return pd.NA if ownership in UNDEFINED_OWNERSHIP else ownership
+
+
+class DataPreparer:
+    """Prepares raw car listings for the model.
+
+    ``fit`` learns the dataset-wide statistics (fill values, modes, outlier
+    bounds and the Km/year ratio) from the training data, and ``transform``
+    applies them to new rows without recomputing anything, so a single
+    row at prediction time is prepared exactly like the training data.
+    """
+
+    def __init__(self):
+        self.fitted_ = False
+
+    def fit(self, df):
+        self.fit_transform(df)
+        return self
+
+    def fit_transform(self, df, timings=None, n_jobs=None):
+        return self._prepare(df, fit=True, timings=timings, n_jobs=n_jobs)
+
+    def transform(self, df, timings=None, n_jobs=None):
+        if not self.fitted_:
+            raise ValueError("DataPreparer must be fitted before calling transform")
+        return self._prepare(df, fit=False, timings=timings, n_jobs=n_jobs)
+
+    def _description_pool(self, n_jobs):
+        # Worker processes for the description pass when n_jobs asks for more than one;
+        # they only start once there are enough distinct descriptions to share out
+        n_jobs = _resolve_jobs(n_jobs)
+        if n_jobs <= 1:
+            return contextlib.nullcontext()
+        return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_description_worker,
+                                   initargs=(self.unique_manufactors_, self.unique_models_))
+
+    def _stages(self, fit, pool=None):
+        # The preparation steps in order; each one takes and returns the DataFrame
+        return [
+            ('drop_columns', self._drop_columns),
+            ('clean_model', self._clean_model),
+            ('fill_from_description', lambda df: self._fill_from_description(df, pool)),
+            ('drop_sparse_columns', lambda df: self._drop_sparse_columns(df, fit)),
+            ('replace_values', self._replace_values),
+            ('fill_year_and_hand', lambda df: self._fill_year_and_hand(df, fit)),
+            ('fill_gear', lambda df: self._fill_gear(df, fit)),
+            ('fill_capacity_engine', lambda df: self._fill_capacity_engine(df, fit)),
+            ('fill_engine_type', lambda df: self._fill_engine_type(df, fit)),
+            ('derive_km', lambda df: self._derive_km(df, fit)),
+            ('combine_ownership', lambda df: self._combine_ownership(df, fit)),
+            # Remove 'Description' column
+            ('drop_ownership_columns', lambda df: df.drop(columns=['Prev_ownership', 'Curr_ownership', 'Description'])),
+        ]
+
+    def _prepare(self, df, fit, timings=None, n_jobs=None, pool=None):
+        # When a timings dict is given, the seconds spent in each stage are added to it
+        start = time.perf_counter()
+        if fit:
+            # Define unique manufactors and models for extraction
+            self.unique_manufactors_ = df['manufactor'].unique()
+            self.unique_models_ = df['model'].unique()
+            self.matcher_ = DescriptionMatcher(self.unique_manufactors_, self.unique_models_)
+            self.current_year_ = datetime.now().year
+            _add_timing(timings, 'build_matcher', start)
+
+        df_dropped = df
+        # A pool given by the caller is reused, otherwise one is started for this call when n_jobs asks for it
+        with contextlib.nullcontext(pool) if pool is not None else self._description_pool(n_jobs) as pool:
+            for name, stage in self._stages(fit, pool):
+                start = time.perf_counter()
+                df_dropped = stage(df_dropped)
+                _add_timing(timings, name, start)
+
+        if fit:
+            self.fitted_ = True
+        return df_dropped
+
+    def _drop_columns(self, df):
+        return df.drop(columns=COLUMNS_TO_DROP, errors='ignore')
+
+    def _clean_model(self, df):
+        # Standardize data by removing the 'manufactor' word from 'model' and removing years (numbers in parentheses),
+        # once per distinct (manufactor, model) pair
+        df['model'] = _map_distinct(_clean_model_name, df['manufactor'], df['model'])
+        return df
+
+    def _match_distinct(self, method, descriptions, pool=None):
+        # A matcher method applied once per distinct description, shared out to the worker processes when
+        # there is a pool; executor.map keeps the order of the tasks, so the result is the serial one
+        row_codes, distinct = _distinct_values(descriptions)
+        values = [description for description, in distinct]
+        if pool is None or len(values) < DESCRIPTION_TASK_SIZE:
+            results = [getattr(self.matcher_, method)(description) for description in values]
+        else:
+            tasks = [values[i:i + DESCRIPTION_TASK_SIZE] for i in range(0, len(values), DESCRIPTION_TASK_SIZE)]
+            results = list(itertools.chain.from_iterable(pool.map(_match_descriptions, [method] * len(tasks), tasks)))
+        return _map_back(results, row_codes, descriptions.index)
+
+    def _fill_from_description(self, df, pool=None):
+        # Fill missing values in Prev_ownership and Curr_ownership
+        missing = df['Prev_ownership'].isna() | df['Curr_ownership'].isna()
+        ownership_from_desc = self._match_distinct('ownership', df.loc[missing, 'Description'], pool).dropna()
+        df.loc[ownership_from_desc.index, 'Prev_ownership'] = df.loc[ownership_from_desc.index, 'Prev_ownership'].fillna(ownership_from_desc)
+        df.loc[ownership_from_desc.index, 'Curr_ownership'] = df.loc[ownership_from_desc.index, 'Curr_ownership'].fillna(ownership_from_desc)
+
+        # Fill values from description, only for rows that have something to fill; repeated descriptions are searched once
+        needs_fill = df['Description'].notnull() & df[DESCRIPTION_COLUMNS].isnull().any(axis=1)
+        extracted = self._match_distinct('extract', df.loc[needs_fill, 'Description'], pool)
+        for index, info in extracted.items():
+            for key, value in info.items():
+                if pd.isnull(df.at[index, key]):
+                    df.at[index, key] = value
+        return df
+
+    def _drop_sparse_columns(self, df, fit):
+        if fit:
+            # Filter columns with more than 50% missing values
+            missing_percentage = (df.isnull().sum() / len(df)) * 100
+            self.sparse_columns_ = missing_percentage[missing_percentage > 50].index.tolist()
+        return df.drop(columns=self.sparse_columns_, errors='ignore')
+
+    def _replace_values(self, df):
+        # Each distinct value is looked up once, instead of comparing every row with every key
+        for column, replacements in [('model', MODEL_REPLACEMENTS), ('Gear', GEAR_REPLACEMENTS),
+                                     ('Engine_type', ENGINE_TYPE_REPLACEMENTS), ('manufactor', MANUFACTOR_REPLACEMENTS)]:
+            if df[column].dtype == object:
+                df[column] = _map_distinct(lambda value: replacements.get(value, value), df[column])
+            else:
+                # A column without any text, such as an all-missing one
+                df[column] = df[column].replace(replacements)
+        return df
+
+    def _fill_year_and_hand(self, df, fit):
+        # Add a column Years_Since_Year indicating the number of years the car has been on the road
+        current_year = self.current_year_
+        df['Years_Since_Year'] = current_year - df['Year']
 
-    # Fill missing values with the most common value
-    most_common_ownership = df_dropped['ownership'].mode()[0]
-    df_dropped['ownership'].fillna(most_common_ownership, inplace=True)
+        if fit:
+            # Calculate the mean ratio on rows with no missing values in Hand and Years_Since_Year columns
+            valid_rows = df.dropna(subset=['Hand', 'Years_Since_Year'])
+            ratios = valid_rows['Years_Since_Year'] / valid_rows['Hand']
+            self.mean_ratio_ = _mean_from_counts(ratios.value_counts().to_dict())
+        mean_ratio = self.mean_ratio_
+
+        # Fill missing values in Hand column
+        df['Hand'] = df['Hand'].fillna(df['Years_Since_Year'] / mean_ratio)
+
+        # Fill missing values in Years_Since_Year and Year columns
+        df['Years_Since_Year'] = df['Years_Since_Year'].fillna(df['Hand'] * mean_ratio)
+        df['Year'] = df['Year'].fillna(current_year - df['Years_Since_Year'])
+        return df
+
+    def _fill_gear(self, df, fit):
+        if fit:
+            # Create a dictionary with the most common values in the Gear column by year
+            self.gear_mode_by_year_ = df.groupby('Year')['Gear'].agg(_mode_or_none).to_dict()
+        gear_mode_by_year = self.gear_mode_by_year_
+
+        # Fill missing values and undefined values in Gear column according to the gear_mode_by_year dictionary
+        undefined = df['Gear'].isna() | (df['Gear'] == UNDEFINED_GEAR)
+        df.loc[undefined, 'Gear'] = df.loc[undefined, 'Year'].map(gear_mode_by_year.get)
+        return df
 
-    # Remove 'Description' column
-    df_dropped.drop(columns=['Prev_ownership', 'Curr_ownership', 'Description'], inplace=True)
-    
-    return df_dropped
\ No newline at end of file
+    def _fill_capacity_engine(self, df, fit):
+        # Convert 'capacity_Engine' column to numeric, setting errors='coerce' to convert invalid parsing to NaN
+        df['capacity_Engine'] = pd.to_numeric(df['capacity_Engine'], errors='coerce')
+
+        if fit:
+            self.median_capacity_ = df['capacity_Engine'].median()
+
+        # Replace NaN values with the median value
+        df['capacity_Engine'] = df['capacity_Engine'].fillna(self.median_capacity_)
+
+        if fit:
+            # Identify outliers using IQR
+            Q1 = df['capacity_Engine'].quantile(0.25)
+            Q3 = df['capacity_Engine'].quantile(0.75)
+            IQR = Q3 - Q1
+            self.capacity_bounds_ = (Q1 - 1.5 * IQR, Q3 + 1.5 * IQR)
+        lower_bound, upper_bound = self.capacity_bounds_
+
+        # Handle outliers without changing other data
+        df['capacity_Engine'] = df['capacity_Engine'].clip(lower_bound, upper_bound)
+        return df
+
+    def _fill_engine_type(self, df, fit):
+        if fit:
+            # Create a dictionary with the most common values in the Engine_type column by manufactor
+            self.engine_type_mode_by_manufactor_ = df.groupby('manufactor')['Engine_type'].agg(_mode_or_none).to_dict()
+        engine_type_mode_by_manufactor = self.engine_type_mode_by_manufactor_
+
+        # Fill missing values in Engine_type column according to the engine_type_mode_by_manufactor dictionary
+        missing = df['Engine_type'].isnull()
+        df.loc[missing, 'Engine_type'] = df.loc[missing, 'manufactor'].map(engine_type_mode_by_manufactor.get)
+        return df
+
+    def _clean_km(self, df):
+        # Remove commas and replace 'None' with NaN
+        df['Km'] = df['Km'].astype(str).str.replace(',', '').replace('None', np.nan)
+
+        # Remove rows with non-convertible values
+        df = df[pd.to_numeric(df['Km'], errors='coerce').notnull()].copy()
+
+        # Convert to float and then to int
+        df['Km'] = df['Km'].astype(float).astype(int)
+
+        # Remove rows with Km value of 1000000
+        df = df[df['Km'] != 1000000].copy()
+
+        # Multiply values less than 500 by 1000
+        df.loc[df['Km'] < 500, 'Km'] *= 1000
+        return df
+
+    def _derive_km(self, df, fit):
+        df = self._clean_km(df)
+
+        if fit:
+            # Km per year on the road, from the non-zero Km values
+            sum_km = df[df['Km'] != 0]['Km'].sum()
+            sum_year_difference = _sum_from_counts(df['Years_Since_Year'].value_counts().to_dict())
+            self.km_per_year_ = sum_km / sum_year_difference
+        km_per_year = self.km_per_year_
+
+        # Calculate new values in 'Km' column based on the requested formula
+        df['Km'] = km_per_year * df['Years_Since_Year']
+
+        # Convert 'Km' column to string, once per distinct value
+        df['Km'] = _map_distinct(str, df['Km'])
+
+        # Remove 'Years_Since_Year' column
+        return df.drop(columns=['Years_Since_Year'])
+
+    def _combine_ownership(self, df, fit):
+        df['ownership'] = self._ownership(df)
+
+        if fit:
+            self.most_common_ownership_ = df['ownership'].mode()[0]
+
+        # Fill missing values with the most common value
+        df['ownership'] = df['ownership'].fillna(self.most_common_ownership_)
+        return df
+
+    def _ownership(self, df):
+        # Combine the columns once per distinct (Prev_ownership, Curr_ownership) pair
+        return _map_distinct(_combined_ownership, df['Prev_ownership'], df['Curr_ownership'])
+
+    def fit_csv(self, path, chunksize=100000, timings=None, n_jobs=None, **read_csv_kwargs):
+        # Fit on a CSV read chunk by chunk, so memory is bounded by the chunk size.
+        # The first pass reads only the vocabulary of the description matcher.
+        manufactors, models = {}, {}
+        for chunk in _read_chunks(path, chunksize, timings, usecols=['manufactor', 'model'], **read_csv_kwargs):
+            start = time.perf_counter()
+            manufactors.update(dict.fromkeys(chunk['manufactor'].dropna().unique()))
+            models.update(dict.fromkeys(chunk['model'].dropna().unique()))
+            _add_timing(timings, 'build_matcher', start)
+        start = time.perf_counter()
+        self.unique_manufactors_ = np.array(list(manufactors), dtype=object)
+        self.unique_models_ = np.array(list(models), dtype=object)
+        self.matcher_ = DescriptionMatcher(self.unique_manufactors_, self.unique_models_)
+        self.current_year_ = datetime.now().year
+        _add_timing(timings, 'build_matcher', start)
+
+        # The second pass accumulates the counts and sums behind the statistics
+        statistics = _StreamingStatistics(self.current_year_)
+        with self._description_pool(n_jobs) as pool:
+            for chunk in _read_chunks(path, chunksize, timings, **read_csv_kwargs):
+                df = _timed(timings, 'drop_columns', self._drop_columns, chunk)
+                df = _timed(timings, 'clean_model', self._clean_model, df)
+                df = _timed(timings, 'fill_from_description', self._fill_from_description, df, pool)
+                _timed(timings, 'fit_statistics', statistics.add_missing, df)
+                df = _timed(timings, 'replace_values', self._replace_values, df)
+                _timed(timings, 'fit_statistics', statistics.add_rows, df)
+                kept = _timed(timings, 'clean_km', self._clean_km, df)
+                ownership = _timed(timings, 'combine_ownership', self._ownership, kept)
+                _timed(timings, 'fit_statistics', statistics.add_kept_rows, kept, ownership)
+        _timed(timings, 'fit_statistics', statistics.resolve, self)
+        self.fitted_ = True
+        return self
+
+    def transform_csv(self, path, chunksize=100000, timings=None, n_jobs=None, **read_csv_kwargs):
+        # The prepared chunks of a CSV, keeping the row numbers of the file as the index; the worker processes
+        # of the description pass are shared by all the chunks
+        if not self.fitted_:
+            raise ValueError("DataPreparer must be fitted before calling transform_csv")
+        with self._description_pool(n_jobs) as pool:
+            for chunk in _read_chunks(path, chunksize, timings, **read_csv_kwargs):
+                yield self._prepare(chunk, fit=False, timings=timings, pool=pool)
+
+
+def _mode_from_counts(counts):
+    # Like Series.mode()[0]: the most frequent value, the smallest one on ties
+    if not counts:
+        return None
+    most = max(counts.values())
+    return min(value for value, count in counts.items() if count == most)
+
+
+def _quantile_from_counts(counts, q):
+    # Like Series.quantile(q) with linear interpolation, from the counts of each value
+    values = sorted(counts)
+    cumulative = np.cumsum([counts[value] for value in values])
+    position = q * (cumulative[-1] - 1)
+    lower, upper = int(np.floor(position)), int(np.ceil(position))
+    a = values[np.searchsorted(cumulative, lower, side='right')]
+    b = values[np.searchsorted(cumulative, upper, side='right')]
+    t = position - lower
+    # The same lerp as numpy.quantile
+    return b - (b - a) * (1 - t) if t >= 0.5 else a + (b - a) * t
+
+
+class _StreamingStatistics:
+    """The statistics of DataPreparer.fit, accumulated one chunk at a time.
+
+    Sums and modes are kept as value counts, which is what the in-memory
+    fit reduces too, so both give the same statistics. Year and
+    Years_Since_Year of rows without a Year are only known once the mean
+    Years_Since_Year/Hand ratio of the whole file is, so those rows are
+    counted by Hand and resolved at the end.
+    """
+
+    def __init__(self, current_year):
+        self.current_year = current_year
+        self.rows = 0
+        self.missing = {}
+        self.ratios = {}
+        self.gears = {}
+        self.capacities = {}
+        self.missing_capacities = 0
+        self.engine_types = {}
+        self.sum_km = 0
+        self.years_since_year = {}
+        self.hands_without_year = {}
+        self.ownerships = {}
+
+    def add_missing(self, df):
+        # Missing values after the description fill, for the sparse columns
+        self.rows += len(df)
+        for column, count in df.isnull().sum().items():
+            self.missing[column] = self.missing.get(column, 0) + int(count)
+
+    def add_rows(self, df):
+        years_since_year = self.current_year - df['Year']
+        hand = df['Hand']
+
+        # Years_Since_Year/Hand ratio on rows with both values
+        valid = years_since_year.notna() & hand.notna()
+        for ratio, count in (years_since_year[valid] / hand[valid]).value_counts().items():
+            self.ratios[ratio] = self.ratios.get(ratio, 0) + int(count)
+
+        # Gear counts by year, or by hand for rows whose year is filled from it
+        has_year = df['Year'].notna()
+        by_hand = ~has_year & hand.notna()
+        for kind, rows, key in [('year', has_year, 'Year'), ('hand', by_hand, 'Hand')]:
+            keys = df.loc[rows, key]
+            for value in keys.unique():
+                self.gears.setdefault((kind, value), {})
+            counts = df.loc[rows & df['Gear'].notna()].groupby([key, 'Gear']).size()
+            for (value, gear), count in counts.items():
+                group = self.gears[(kind, value)]
+                group[gear] = group.get(gear, 0) + int(count)
+
+        # Capacity value counts, for the median and the IQR bounds
+        capacity = pd.to_numeric(df['capacity_Engine'], errors='coerce')
+        self.missing_capacities += int(capacity.isna().sum())
+        for value, count in capacity.value_counts().items():
+            self.capacities[value] = self.capacities.get(value, 0) + int(count)
+
+        # Engine type counts by manufactor
+        for manufactor in df['manufactor'].dropna().unique():
+            self.engine_types.setdefault(manufactor, {})
+        counts = df[df['Engine_type'].notna()].groupby(['manufactor', 'Engine_type']).size()
+        for (manufactor, engine_type), count in counts.items():
+            group = self.engine_types[manufactor]
+            group[engine_type] = group.get(engine_type, 0) + int(count)
+
+    def add_kept_rows(self, df, ownership):
+        # Rows that survive the Km cleaning
+        self.sum_km += int(df.loc[df['Km'] != 0, 'Km'].sum())
+        for value, count in (self.current_year - df['Year']).value_counts().items():
+            self.years_since_year[value] = self.years_since_year.get(value, 0) + int(count)
+        for hand, count in df.loc[df['Year'].isna(), 'Hand'].value_counts().items():
+            self.hands_without_year[hand] = self.hands_without_year.get(hand, 0) + int(count)
+        for value, count in ownership.value_counts().items():
+            self.ownerships[value] = self.ownerships.get(value, 0) + int(count)
+
+    def resolve(self, preparer):
+        preparer.sparse_columns_ = [column for column, count in self.missing.items() if (count / self.rows) * 100 > 50]
+        preparer.mean_ratio_ = mean_ratio = _mean_from_counts(self.ratios)
+
+        gears = {}
+        for (kind, value), counts in self.gears.items():
+            year = value if kind == 'year' else self.current_year - value * mean_ratio
+            group = gears.setdefault(year, {})
+            for gear, count in counts.items():
+                group[gear] = group.get(gear, 0) + count
+        preparer.gear_mode_by_year_ = {year: _mode_from_counts(counts) for year, counts in sorted(gears.items())}
+
+        preparer.median_capacity_ = median = (_quantile_from_counts(self.capacities, 0.5)
+                                              if self.capacities else np.nan)
+        # The bounds are taken after the missing capacities are filled with the median
+        filled = dict(self.capacities)
+        if self.missing_capacities and not np.isnan(median):
+            filled[median] = filled.get(median, 0) + self.missing_capacities
+        q1, q3 = _quantile_from_counts(filled, 0.25), _quantile_from_counts(filled, 0.75)
+        preparer.capacity_bounds_ = (q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1))
+
+        preparer.engine_type_mode_by_manufactor_ = {
+            manufactor: _mode_from_counts(counts) for manufactor, counts in sorted(self.engine_types.items())
+        }
+        years_since_year = dict(self.years_since_year)
+        for hand, count in self.hands_without_year.items():
+            years_since_year[hand * mean_ratio] = years_since_year.get(hand * mean_ratio, 0) + count
+        preparer.km_per_year_ = self.sum_km / _sum_from_counts(years_since_year)
+        preparer.most_common_ownership_ = _mode_from_counts(self.ownerships)
+
+
+def prepare_data(df, n_jobs=None):
+    return DataPreparer().fit_transform(df, n_jobs=n_jobs)
+
+
+def prepare_csv(path, output_path, chunksize=100000, n_jobs=None):
+    # Prepare a CSV that does not fit in memory into another CSV, one chunk at a time
+    preparer = DataPreparer().fit_csv(path, chunksize, n_jobs=n_jobs)
+    for i, prepared in enumerate(preparer.transform_csv(path, chunksize, n_jobs=n_jobs)):
+        prepared.to_csv(output_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return preparer
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from description_matcher import DescriptionMatcher
+from inference import CompiledModel, CompiledPipeline, RecordPreparer
+
+# Bumped when the layout of the artifact changes; older readers refuse newer formats
+COMPACT_FORMAT = 1
+
+MANIFEST = 'manifest.json'
+
+
+def _save_array(path, name, values, manifest):
+    # Files are named after their content, so a new export never overwrites a file a reader may have open
+    values = np.asarray(values)
+    digest = hashlib.sha256(values.dtype.str.encode() + values.tobytes()).hexdigest()[:12]
+    filename = f'{name}-{digest}.npy'
+    if not os.path.exists(os.path.join(path, filename)):
+        tmp_path = os.path.join(path, f'{filename}.{uuid.uuid4().hex}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, os.path.join(path, filename))
+    manifest['arrays'][name] = filename
+
+
+def _load_array(path, manifest, name, mmap):
+    return np.load(os.path.join(path, manifest['arrays'][name]), mmap_mode='r' if mmap else None)
+
+
+def save_compact(model, path):
+    """Writes a CompiledModel as NumPy arrays and a JSON manifest in the directory path.
+
+    The manifest is replaced last and atomically, so a reader sees either
+    the previous model or the new one. Array files no longer listed in it
+    are removed afterwards.
+    """
+    os.makedirs(path, exist_ok=True)
+    pipeline, preparer = model.pipeline, model.preparer
+    manifest = {
+        'format': COMPACT_FORMAT,
+        'arrays': {},
+        'numeric_features': [name for name, *_ in pipeline.numeric],
+        'categorical_features': [name for name, *_ in pipeline.categorical],
+    }
+
+    # Imputer fill values, scaler parameters and coefficients of the numeric features
+    for i, part in enumerate(['fill', 'mean', 'scale', 'coef'], start=1):
+        _save_array(path, f'numeric_{part}', np.array([feature[i] for feature in pipeline.numeric], dtype=np.float64), manifest)
+
+    # The one-hot vocabulary of each categorical feature with the coefficient of each category
+    _save_array(path, 'categorical_fill', np.array([fill for _, fill, _ in pipeline.categorical], dtype=str), manifest)
+    for i, (name, fill, table) in enumerate(pipeline.categorical):
+        _save_array(path, f'categorical_{i}_categories', np.array(list(table), dtype=str), manifest)
+        _save_array(path, f'categorical_{i}_coef', np.array(list(table.values()), dtype=np.float64), manifest)
+    _save_array(path, 'intercept', np.array([pipeline.intercept], dtype=np.float64), manifest)
+
+    # The statistics of the data preparer; the description matcher is rebuilt from its vocabularies
+    _save_array(path, 'manufactor_vocabulary', np.array(preparer.matcher.manufactors.vocabulary, dtype=str), manifest)
+    _save_array(path, 'model_vocabulary', np.array(preparer.matcher.models.vocabulary, dtype=str), manifest)
+    manifest['preparer'] = {
+        'current_year': preparer.current_year,
+        'mean_ratio': preparer.mean_ratio,
+        'gear_mode_by_year': [[float(year), mode] for year, mode in preparer.gear_mode_by_year.items()],
+        'median_capacity': preparer.median_capacity,
+        'capacity_bounds': list(preparer.capacity_bounds),
+        'engine_type_mode_by_manufactor': preparer.engine_type_mode_by_manufactor,
+        'km_per_year': preparer.km_per_year,
+        'most_common_ownership': preparer.most_common_ownership,
+        'replacements': preparer.replacements,
+        'ownership_ranking': preparer.ownership_ranking,
+        'undefined_gear': preparer.undefined_gear,
+        'undefined_ownership': sorted(preparer.undefined_ownership),
+    }
+
+    tmp_path = os.path.join(path, f'{MANIFEST}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+    # Readers that already opened the previous arrays keep them until they close them
+    for filename in set(os.listdir(path)) - set(manifest['arrays'].values()) - {MANIFEST}:
+        if filename.endswith('.npy'):
+            os.remove(os.path.join(path, filename))
+    return manifest
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST), 'rb') as f:
+        manifest_bytes = f.read()
+    manifest = json.loads(manifest_bytes)
+    if manifest.get('format') != COMPACT_FORMAT:
+        raise ValueError(f"Unsupported compact model format {manifest.get('format')} in {path}")
+    return manifest_bytes, manifest
+
+
+def load_compact(path, manifest=None, mmap=True):
+    """Builds a CompiledModel from a directory written by save_compact.
+
+    Only NumPy is needed: the arrays are memory-mapped and turned into
+    the lookup tables of CompiledPipeline and RecordPreparer.
+    """
+    if manifest is None:
+        _, manifest = read_manifest(path)
+
+    def array(name):
+        return _load_array(path, manifest, name, mmap)
+
+    numeric = list(zip(manifest['numeric_features'], *(array(f'numeric_{part}').tolist()
+                                                        for part in ['fill', 'mean', 'scale', 'coef'])))
+    fills = array('categorical_fill').tolist()
+    categorical = []
+    for i, name in enumerate(manifest['categorical_features']):
+        table = dict(zip(array(f'categorical_{i}_categories').tolist(), array(f'categorical_{i}_coef').tolist()))
+        categorical.append((name, fills[i], table))
+    pipeline = CompiledPipeline(numeric, categorical, array('intercept').tolist()[0])
+
+    stats = manifest['preparer']
+    preparer = RecordPreparer(
+        matcher=DescriptionMatcher(array('manufactor_vocabulary').tolist(), array('model_vocabulary').tolist()),
+        current_year=stats['current_year'],
+        mean_ratio=stats['mean_ratio'],
+        gear_mode_by_year={year: mode for year, mode in stats['gear_mode_by_year']},
+        median_capacity=stats['median_capacity'],
+        capacity_bounds=tuple(stats['capacity_bounds']),
+        engine_type_mode_by_manufactor=stats['engine_type_mode_by_manufactor'],
+        km_per_year=stats['km_per_year'],
+        most_common_ownership=stats['most_common_ownership'],
+        replacements=stats['replacements'],
+        ownership_ranking=stats['ownership_ranking'],
+        undefined_gear=stats['undefined_gear'],
+        undefined_ownership=stats['undefined_ownership'],
+    )
+    return CompiledModel(preparer, pipeline)
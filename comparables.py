@@ -0,0 +1,103 @@
+import math
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+# The numeric features listings are compared on, after standardizing each one
+FEATURES = ['Year', 'Hand', 'Km', 'capacity_Engine']
+
+# The columns of a listing returned with its distance
+LISTING_COLUMNS = ['manufactor', 'model', 'Year', 'Hand', 'Km', 'capacity_Engine', 'Gear', 'Engine_type', 'Price']
+
+
+def clean_km(values):
+    # The odometer reading like DataPreparer._clean_km: commas removed, values under 500 are in thousands
+    km = pd.to_numeric(values.astype(str).str.replace(',', ''), errors='coerce')
+    return km.where(km >= 500, km * 1000)
+
+
+def odometer(km):
+    # clean_km for the Km of a single car
+    return km * 1000 if km < 500 else km
+
+
+def build_listings(prepared, raw_km):
+    # The prepared listings (filled and cleaned like the training data) with their actual odometer reading,
+    # which the preparation replaces with a value derived from the year; both are indexed by the CSV row
+    listings = prepared.copy()
+    listings['Km'] = clean_km(raw_km.loc[prepared.index])
+    return listings.dropna(subset=FEATURES + ['Price'])
+
+
+def _json_value(value):
+    # Missing values as null
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+class ComparablesIndex:
+    """The historical listings most similar to a car, with their actual price.
+
+    Listings are partitioned by (manufactor, model), with a KD-tree per
+    partition over the standardized Year/Hand/Km/capacity_Engine. A car
+    whose model has fewer than k listings is compared with its
+    manufactor's listings, and failing that with all of them.
+    """
+
+    def __init__(self, leaf_size=16):
+        self.leaf_size = leaf_size
+
+    def fit(self, listings):
+        values = listings[FEATURES].to_numpy(dtype=float)
+        self.mean_ = values.mean(axis=0)
+        self.scale_ = values.std(axis=0)
+        self.scale_[self.scale_ == 0] = 1.0
+        scaled = (values - self.mean_) / self.scale_
+
+        self.rows_ = listings.index.to_numpy()
+        self.listings_ = {column: listings[column].tolist() for column in LISTING_COLUMNS}
+
+        # Positions of the listings of each partition, from the narrowest to the widest
+        positions = np.arange(len(listings))
+        self.partitions_ = {('all',): self._tree(scaled, positions)}
+        for manufactor, group in listings.groupby('manufactor', sort=False).indices.items():
+            self.partitions_[('manufactor', manufactor)] = self._tree(scaled, positions[group])
+        for (manufactor, model), group in listings.groupby(['manufactor', 'model'], sort=False).indices.items():
+            self.partitions_[('model', manufactor, model)] = self._tree(scaled, positions[group])
+        return self
+
+    def _tree(self, scaled, positions):
+        return KDTree(scaled[positions], leaf_size=self.leaf_size), positions
+
+    def query(self, car, k=5):
+        # car holds the prepared manufactor, model, Year, Hand, capacity_Engine and the odometer reading as Km
+        point = np.array([[float(car[feature]) for feature in FEATURES]])
+        if np.isnan(point).any():
+            raise ValueError(f"Comparables need {', '.join(FEATURES)}")
+        point[0, FEATURES.index('Km')] = odometer(point[0, FEATURES.index('Km')])
+        point = (point - self.mean_) / self.scale_
+
+        # The narrowest partition with at least k listings
+        key = ('all',)
+        for candidate in [('model', car['manufactor'], car['model']), ('manufactor', car['manufactor'])]:
+            if candidate in self.partitions_ and len(self.partitions_[candidate][1]) >= k:
+                key = candidate
+                break
+        tree, positions = self.partitions_[key]
+        distances, found = tree.query(point, k=min(k, len(positions)))
+
+        comparables = []
+        for distance, position in zip(distances[0], positions[found[0]]):
+            listing = {column: _json_value(self.listings_[column][position]) for column in LISTING_COLUMNS}
+            listing['row'] = int(self.rows_[position])
+            listing['distance'] = round(float(distance), 4)
+            comparables.append(listing)
+        return key[0], comparables
+
+    def save(self, path):
+        # Written next to the model and replaced atomically, like the model artifact
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,174 @@
+import re
+
+# Gear and engine values searched for in the description (first match wins)
+GEARS = ['אוטומטית', 'טיפטרוניק', 'ידנית', 'רובוטית', 'אוטומט', 'לא מוגדר']
+ENGINE_TYPES = ['בנזין', 'דיזל', 'גז', 'היברידי', 'היבריד', 'טורבו דיזל', 'חשמלי']
+
+# Ownership types searched for in the description
+OWNERSHIP_TYPES = ['פרטית', 'השכרה', 'ליסינג', 'מונית', 'לימוד נהיגה', 'ייבוא אישי', 'ממשלתי']
+
+YEAR_PATTERN = re.compile(r'שנה\s(198[0-9]|199[0-9]|200[0-9]|201[0-9]|202[0-4])\b')
+HAND_PATTERN = re.compile(r'\b(\d+)\s*יד\b')
+CAPACITY_ENGINE_PATTERN = re.compile(r'(?:(?:נפח|מנוע|נפח מנוע)\s*(\d+))')
+OWNERSHIP_PATTERN = re.compile('|'.join(OWNERSHIP_TYPES))
+
+
+REGEX_SPECIAL_CHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+def _literal_text(entry):
+    # The text an entry matches when it is a plain string, possibly with literal groups like "(2014)"
+    if not any(ch in REGEX_SPECIAL_CHARACTERS for ch in entry):
+        return entry
+    depth = 0
+    for ch in entry:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        if depth not in (0, 1):
+            return None
+    text = entry.replace('(', '').replace(')', '')
+    if depth != 0 or entry.startswith('(?') or '()' in entry or any(ch in REGEX_SPECIAL_CHARACTERS for ch in text):
+        return None
+    return text
+
+
+def _trie_pattern(node):
+    # Alternation over the children of a trie node, optional when the node ends an entry
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch != '']
+    if not branches:
+        return ''
+    if '' not in node and len(branches) == 1:
+        return branches[0]
+    pattern = '(?:%s)' % '|'.join(branches)
+    return pattern + '?' if '' in node else pattern
+
+
+class VocabularyPattern:
+    """All the patterns of a vocabulary compiled for a single scan of the text.
+
+    Each vocabulary entry is a regex of its own, and the original loop kept
+    the last (or first) entry that matched anywhere in the text. Plain
+    entries are merged into one prefix-trie regex that finds, at every
+    position, the longest entry starting there; every other entry matching
+    at that position is a prefix of it, so the best of them is looked up in
+    a table built once. The few entries that really are regexes are still
+    searched one by one, with precompiled patterns.
+    """
+
+    def __init__(self, vocabulary, last_wins, flags=0):
+        self.vocabulary = [entry for entry in vocabulary if isinstance(entry, str)]
+        self.ignore_case = bool(flags & re.IGNORECASE)
+
+        # Higher priority wins: the later entry when last_wins, the earlier one otherwise
+        count = len(self.vocabulary)
+        priorities = range(count) if last_wins else range(count - 1, -1, -1)
+
+        trie = {}
+        self.priority_by_key = {}
+        self.regex_entries = []
+        for entry, priority in zip(self.vocabulary, priorities):
+            text = _literal_text(entry)
+            if text and self.ignore_case and len(text.lower()) != len(text):
+                text = None
+            if not text:
+                self.regex_entries.append((re.compile(entry, flags), priority))
+                continue
+            key = text.lower() if self.ignore_case else text
+            self.priority_by_key[key] = max(priority, self.priority_by_key.get(key, -1))
+            node = trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[''] = {}
+
+        # For every entry, the best priority among the entries that are its prefixes
+        self.best_by_key = {}
+        for key in self.priority_by_key:
+            best = -1
+            for end in range(1, len(key) + 1):
+                best = max(best, self.priority_by_key.get(key[:end], -1))
+            self.best_by_key[key] = best
+
+        self.pattern = re.compile('(?=(%s))' % _trie_pattern(trie), flags) if trie else None
+        self.entry_by_priority = dict(zip(priorities, self.vocabulary))
+        self.top = count - 1
+
+    def search(self, text):
+        best = -1
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                key = match.group(1)
+                if self.ignore_case:
+                    key = key.lower()
+                best = max(best, self.best_by_key.get(key, -1))
+                # Stop early once the highest priority entry has been seen
+                if best == self.top:
+                    return self.entry_by_priority[best]
+        for pattern, priority in self.regex_entries:
+            if priority > best and pattern.search(text):
+                best = priority
+        return self.entry_by_priority.get(best)
+
+
+class DescriptionMatcher:
+    """Extracts car attributes from a listing description.
+
+    The vocabularies are compiled once, when the matcher is built, instead
+    of searching every manufactor and model pattern for every row.
+    """
+
+    def __init__(self, unique_manufactors, unique_models):
+        # The last matching manufactor and model win, the first gear and engine type win
+        self.manufactors = VocabularyPattern(unique_manufactors, last_wins=True)
+        self.models = VocabularyPattern(unique_models, last_wins=True, flags=re.IGNORECASE)
+        self.gears = VocabularyPattern(GEARS, last_wins=False, flags=re.IGNORECASE)
+        self.engine_types = VocabularyPattern(ENGINE_TYPES, last_wins=False, flags=re.IGNORECASE)
+
+    def extract(self, description):
+        info = {}
+
+        # Extract manufactor
+        manufactor = self.manufactors.search(description)
+        if manufactor is not None:
+            info['manufactor'] = manufactor
+
+        # Extract Year
+        year_match = YEAR_PATTERN.search(description)
+        if year_match:
+            info['Year'] = int(year_match.group(1))
+
+        # Extract model
+        model = self.models.search(description)
+        if model is not None:
+            info['model'] = model
+
+        # Extract Hand
+        hand_match = HAND_PATTERN.search(description)
+        if hand_match:
+            info['Hand'] = int(hand_match.group(1))
+
+        # Extract Gear
+        gear = self.gears.search(description)
+        if gear is not None:
+            info['Gear'] = gear
+
+        # Extract capacity_Engine
+        capacity_engine_match = CAPACITY_ENGINE_PATTERN.search(description)
+        if capacity_engine_match:
+            info['capacity_Engine'] = int(capacity_engine_match.group(1))
+
+        # Extract Engine_type
+        engine_type = self.engine_types.search(description)
+        if engine_type is not None:
+            info['Engine_type'] = engine_type
+
+        return info
+
+    def ownership(self, description):
+        if not isinstance(description, str):
+            return None
+        match = OWNERSHIP_PATTERN.search(description)
+        if match:
+            return match.group(0)
+        return None
@@ -0,0 +1,274 @@
+import math
+import re
+
+# Years in parentheses that are removed from the 'model' column
+MODEL_YEAR_PATTERN = re.compile(r'\(\d{4}\)')
+
+# Columns converted to numbers before the preparation
+NUMERIC_COLUMNS = ['Year', 'Hand', 'capacity_Engine', 'Km']
+
+# Text columns that reach the model or fill it
+KEY_STRING_COLUMNS = ['manufactor', 'model', 'Gear', 'Engine_type', 'Prev_ownership', 'Curr_ownership']
+
+# Columns that can be filled from the description
+DESCRIPTION_COLUMNS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type']
+
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def to_number(value):
+    # Same result as pd.to_numeric(value, errors='coerce') for a single value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str) or '_' in value:
+        return math.nan
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def is_kept_km(km):
+    # The data preparer drops rows without a usable Km value
+    return not (math.isnan(km) or math.isinf(km) or int(km) == 1000000)
+
+
+def prediction_cache_key(record):
+    # The parts of a form record that can change its prediction: equal keys give equal predictions.
+    # Test never reaches the model, raw Km only decides whether the row is kept (Km is rebuilt from
+    # the year), and the description is only read when a field it can fill is missing.
+    numbers = {column: to_number(record.get(column)) for column in NUMERIC_COLUMNS}
+    strings = {column: record.get(column) for column in KEY_STRING_COLUMNS}
+    fields = dict(strings, **numbers)
+    uses_description = any(is_missing(fields.get(column)) for column in DESCRIPTION_COLUMNS) \
+        or is_missing(fields['Prev_ownership']) or is_missing(fields['Curr_ownership'])
+    return (
+        tuple(strings.values()),
+        # NaN never equals itself, so it is keyed as None
+        tuple(None if math.isnan(numbers[column]) else numbers[column] for column in ['Year', 'Hand', 'capacity_Engine']),
+        is_kept_km(numbers['Km']),
+        record.get('Description') if uses_description else None,
+    )
+
+
+class RowDroppedError(ValueError):
+    pass
+
+
+class RecordPreparer:
+    """Prepares a single car, given as a dict, like DataPreparer.transform.
+
+    It holds the statistics learned by a fitted DataPreparer as plain
+    Python values, so a request is prepared without building a DataFrame.
+    """
+
+    def __init__(self, matcher, current_year, mean_ratio, gear_mode_by_year, median_capacity,
+                 capacity_bounds, engine_type_mode_by_manufactor, km_per_year, most_common_ownership,
+                 replacements, ownership_ranking, undefined_gear, undefined_ownership):
+        self.matcher = matcher
+        self.current_year = current_year
+        self.mean_ratio = mean_ratio
+        self.gear_mode_by_year = gear_mode_by_year
+        self.median_capacity = median_capacity
+        self.capacity_bounds = capacity_bounds
+        self.engine_type_mode_by_manufactor = engine_type_mode_by_manufactor
+        self.km_per_year = km_per_year
+        self.most_common_ownership = most_common_ownership
+        self.replacements = replacements
+        self.ownership_ranking = ownership_ranking
+        self.undefined_gear = undefined_gear
+        self.undefined_ownership = set(undefined_ownership)
+
+    @classmethod
+    def from_preparer(cls, preparer):
+        import car_data_prep
+        return cls(
+            matcher=preparer.matcher_,
+            current_year=preparer.current_year_,
+            mean_ratio=float(preparer.mean_ratio_),
+            gear_mode_by_year=dict(preparer.gear_mode_by_year_),
+            median_capacity=float(preparer.median_capacity_),
+            capacity_bounds=tuple(float(bound) for bound in preparer.capacity_bounds_),
+            engine_type_mode_by_manufactor=dict(preparer.engine_type_mode_by_manufactor_),
+            km_per_year=float(preparer.km_per_year_),
+            most_common_ownership=preparer.most_common_ownership_,
+            replacements={
+                'model': car_data_prep.MODEL_REPLACEMENTS,
+                'Gear': car_data_prep.GEAR_REPLACEMENTS,
+                'Engine_type': car_data_prep.ENGINE_TYPE_REPLACEMENTS,
+                'manufactor': car_data_prep.MANUFACTOR_REPLACEMENTS,
+            },
+            ownership_ranking=car_data_prep.OWNERSHIP_RANKING,
+            undefined_gear=car_data_prep.UNDEFINED_GEAR,
+            undefined_ownership=car_data_prep.UNDEFINED_OWNERSHIP,
+        )
+
+    def transform(self, record):
+        row = dict(record)
+
+        # Convert to numeric values for appropriate columns, like the /predict form handling
+        for column in NUMERIC_COLUMNS:
+            row[column] = to_number(row.get(column))
+
+        # Standardize data by removing the 'manufactor' word from 'model' and removing years (numbers in parentheses)
+        row['model'] = MODEL_YEAR_PATTERN.sub('', row['model'].replace(row['manufactor'], '').strip()).strip()
+
+        # Fill missing values in Prev_ownership and Curr_ownership
+        prev, curr = row.get('Prev_ownership'), row.get('Curr_ownership')
+        if is_missing(prev) or is_missing(curr):
+            ownership_from_desc = self.matcher.ownership(row.get('Description'))
+            if ownership_from_desc:
+                prev = ownership_from_desc if is_missing(prev) else prev
+                curr = ownership_from_desc if is_missing(curr) else curr
+
+        # Fill values from description
+        description = row.get('Description')
+        if not is_missing(description) and any(is_missing(row.get(column)) for column in DESCRIPTION_COLUMNS):
+            for key, value in self.matcher.extract(description).items():
+                if is_missing(row.get(key)):
+                    row[key] = value
+
+        # Replace inconsistent values
+        for column, replacements in self.replacements.items():
+            value = row.get(column)
+            if isinstance(value, str):
+                row[column] = replacements.get(value, value)
+
+        # Fill missing values in Hand, Year and Years_Since_Year
+        year, hand = float(row['Year']), float(row['Hand'])
+        years_since_year = self.current_year - year
+        if math.isnan(hand):
+            hand = years_since_year / self.mean_ratio
+        if math.isnan(years_since_year):
+            years_since_year = hand * self.mean_ratio
+        if math.isnan(year):
+            year = self.current_year - years_since_year
+
+        # Fill missing and undefined values in Gear
+        gear = row.get('Gear')
+        if is_missing(gear) or gear == self.undefined_gear:
+            gear = self.gear_mode_by_year.get(year)
+
+        # Fill missing values in capacity_Engine and handle outliers
+        capacity_engine = float(row['capacity_Engine'])
+        if math.isnan(capacity_engine):
+            capacity_engine = self.median_capacity
+        lower_bound, upper_bound = self.capacity_bounds
+        capacity_engine = min(max(capacity_engine, lower_bound), upper_bound)
+
+        # Fill missing values in Engine_type
+        engine_type = row.get('Engine_type')
+        if is_missing(engine_type):
+            engine_type = self.engine_type_mode_by_manufactor.get(row['manufactor'])
+
+        # Rows without a usable Km value are dropped by the data preparer
+        if not is_kept_km(row['Km']):
+            raise RowDroppedError("Km is missing or invalid")
+
+        # Combine the ownership columns
+        if is_missing(prev):
+            ownership = curr
+        elif is_missing(curr) or prev == curr:
+            ownership = prev
+        else:
+            prev_rank = self.ownership_ranking.get(prev, math.inf)
+            curr_rank = self.ownership_ranking.get(curr, math.inf)
+            ownership = prev if prev_rank < curr_rank else curr
+        if is_missing(ownership) or ownership in self.undefined_ownership:
+            ownership = self.most_common_ownership
+
+        return {
+            'manufactor': row['manufactor'],
+            'Year': year,
+            'model': row['model'],
+            'Hand': hand,
+            'Gear': gear,
+            'capacity_Engine': capacity_engine,
+            'Engine_type': engine_type,
+            'Km': str(self.km_per_year * years_since_year),
+            'ownership': ownership,
+        }
+
+
+class CompiledPipeline:
+    """A fitted preprocessor + linear model pipeline as plain lookup tables.
+
+    Numeric features keep their imputer fill value, scaler mean/scale and
+    coefficient; each categorical feature maps its one-hot categories
+    straight to their coefficients. Predicting a single row is then a few
+    dict lookups and a dot product.
+    """
+
+    def __init__(self, numeric, categorical, intercept):
+        # numeric: [(name, fill, mean, scale, coef)], categorical: [(name, fill, {category: coef})]
+        self.numeric = numeric
+        self.categorical = categorical
+        self.intercept = intercept
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        preprocessor = pipeline.named_steps['preprocessor']
+        model = pipeline.named_steps['model']
+        if not hasattr(model, 'coef_') or not hasattr(preprocessor, 'transformers_'):
+            raise ValueError(f"Cannot compile a {type(model).__name__} model")
+        coef = [float(value) for value in model.coef_]
+        numeric, categorical = [], []
+        position = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop' or len(columns) == 0:
+                continue
+            steps = dict(transformer.steps) if hasattr(transformer, 'steps') else {}
+            kinds = [type(step).__name__ for step in steps.values()]
+            if kinds == ['SimpleImputer', 'StandardScaler']:
+                imputer, scaler = steps.values()
+                for i, column in enumerate(columns):
+                    mean = scaler.mean_[i] if scaler.mean_ is not None else 0.0
+                    scale = scaler.scale_[i] if scaler.scale_ is not None else 1.0
+                    numeric.append((column, float(imputer.statistics_[i]), float(mean), float(scale), coef[position]))
+                    position += 1
+            elif kinds == ['SimpleImputer', 'OneHotEncoder'] and steps['onehot'].drop is None \
+                    and getattr(steps['onehot'], 'infrequent_categories_', None) is None:
+                imputer, encoder = steps.values()
+                for i, column in enumerate(columns):
+                    categories = encoder.categories_[i]
+                    table = dict(zip(categories.tolist(), coef[position:position + len(categories)]))
+                    categorical.append((column, imputer.statistics_[i], table))
+                    position += len(categories)
+            else:
+                raise ValueError(f"Cannot compile the '{name}' transformer: {kinds}")
+        if position != len(coef):
+            raise ValueError("The preprocessor output does not match the model coefficients")
+        return cls(numeric, categorical, float(model.intercept_))
+
+    def predict(self, features):
+        prediction = self.intercept
+        for name, fill, mean, scale, coef in self.numeric:
+            value = features[name]
+            if is_missing(value):
+                value = fill
+            prediction += (value - mean) / scale * coef
+        for name, fill, table in self.categorical:
+            value = features[name]
+            # NaN is imputed with the most frequent category, unknown categories add nothing
+            if isinstance(value, float) and math.isnan(value):
+                value = fill
+            prediction += table.get(value, 0.0)
+        return prediction
+
+
+class CompiledModel:
+    """Single-row inference without pandas or scikit-learn."""
+
+    def __init__(self, preparer, pipeline):
+        self.preparer = preparer
+        self.pipeline = pipeline
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        return cls(RecordPreparer.from_preparer(artifact['preparer']),
+                   CompiledPipeline.from_pipeline(artifact['pipeline']))
+
+    def predict(self, record):
+        return self.pipeline.predict(self.preparer.transform(record))
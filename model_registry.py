@@ -0,0 +1,218 @@
+import hashlib
+import math
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from inference import CompiledModel, RowDroppedError, is_missing, to_number
+
+
+class LoadedModel:
+    """A deserialized model artifact and everything derived from it.
+
+    A compact artifact holds only the compiled model: there is no pipeline
+    or DataPreparer, and DataFrames are predicted row by row with it.
+    """
+
+    def __init__(self, version, artifact, path):
+        self.version = version
+        self.path = path
+        self.pipeline = artifact.get('pipeline')
+        self.preparer = artifact.get('preparer')
+        self.loaded_at = time.time()
+
+        # Compile the pipeline into lookup tables for fast single-row predictions
+        self.compiled = artifact.get('compiled')
+        if self.compiled is None:
+            try:
+                self.compiled = CompiledModel.from_artifact(artifact)
+            except ValueError as e:
+                print(f"Model {version} uses the pandas prediction path: {e}")
+
+    def predict_frame(self, input_df):
+        # pandas is only imported by the paths that build DataFrames
+        import pandas as pd
+
+        if self.pipeline is None:
+            predictions = {}
+            for index, record in zip(input_df.index, input_df.to_dict('records')):
+                # Raw CSV values the DataFrame preparation handles: Km with thousands separators, and
+                # a capacity that is not a number, which gets the median without looking at the description
+                if isinstance(record.get('Km'), str):
+                    record['Km'] = record['Km'].replace(',', '')
+                capacity = record.get('capacity_Engine')
+                if not is_missing(capacity) and math.isnan(to_number(capacity)):
+                    record['capacity_Engine'] = self.compiled.preparer.median_capacity
+                try:
+                    predictions[index] = self.compiled.predict(record)
+                except RowDroppedError:
+                    continue
+            return pd.Series(list(predictions.values()), index=list(predictions), dtype=float)
+
+        # Prepare data using the statistics learned at training time
+        prepared_data = self.preparer.transform(input_df)
+        if prepared_data.empty:
+            # Every row was dropped, which the preprocessor does not accept
+            return pd.Series(dtype=float)
+
+        # Process the data using the ColumnTransformer from the trained model
+        processed_data = self.pipeline.named_steps['preprocessor'].transform(prepared_data)
+
+        # Predict the prices, indexed like the rows that survived the preparation
+        predictions = self.pipeline.named_steps['model'].predict(processed_data)
+        return pd.Series(predictions, index=prepared_data.index)
+
+    def categories(self, column):
+        # The values of a categorical column the fitted one-hot encoder knows, or None without one
+        if self.pipeline is None:
+            return next((list(table) for name, _, table in self.compiled.pipeline.categorical if name == column), None)
+        preprocessor = self.pipeline.named_steps['preprocessor']
+        for _, transformer, columns in getattr(preprocessor, 'transformers_', []):
+            encoder = dict(getattr(transformer, 'steps', [])).get('onehot')
+            if encoder is not None and column in list(columns):
+                return encoder.categories_[list(columns).index(column)].tolist()
+        return None
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'compiled': self.compiled is not None,
+            'compact': self.pipeline is None,
+        }
+
+
+class ModelRegistry:
+    """Loads model artifacts and keeps the last few versions in memory.
+
+    The artifact is loaded lazily on first use. A reload (from the watcher
+    or an admin call) deserializes and warms up the new version before it
+    is swapped in with a single assignment, so requests already holding
+    the previous LoadedModel finish with it. Traffic can be pinned to any
+    kept version, which is also how a rollback is done.
+
+    The path is either a pickled artifact or a directory written by
+    compact_model.save_compact, which loads without pandas or sklearn.
+    """
+
+    def __init__(self, path, keep=3, warm_up=None, watch_interval=0):
+        self.path = path
+        self.keep = keep
+        self.warm_up = warm_up
+        self.watch_interval = watch_interval
+        self.versions = OrderedDict()
+        self.latest = None
+        self.pinned = None
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.watcher = None
+        self.watcher_pid = None
+        self.last_error = None
+
+    def current(self):
+        loaded = self.latest
+        if loaded is None:
+            loaded = self.load()
+        self._start_watching()
+        pinned = self.pinned
+        return self.versions.get(pinned, loaded) if pinned else loaded
+
+    def get(self, version=None):
+        if not version:
+            return self.current()
+        return self.versions.get(version)
+
+    def load(self):
+        # Only one reload at a time; concurrent callers wait and reuse its result
+        with self.reload_lock:
+            if os.path.isdir(self.path):
+                # The manifest lists the content hashes of the arrays, so it identifies the version
+                import compact_model
+                manifest_bytes, manifest = compact_model.read_manifest(self.path)
+                version = hashlib.sha256(manifest_bytes).hexdigest()[:12]
+                load_artifact = lambda: {'compiled': compact_model.load_compact(self.path, manifest)}
+            else:
+                with open(self.path, 'rb') as f:
+                    model_bytes = f.read()
+                version = hashlib.sha256(model_bytes).hexdigest()[:12]
+                load_artifact = lambda: pickle.loads(model_bytes)
+            loaded = self.versions.get(version)
+            if loaded is None:
+                loaded = LoadedModel(version, load_artifact(), self.path)
+                if self.warm_up is not None:
+                    self.warm_up(loaded)
+
+            with self.lock:
+                self.versions[version] = loaded
+                self.versions.move_to_end(version)
+                # Drop the oldest versions, never the pinned one or the new one
+                evictable = [kept for kept in self.versions if kept not in (self.pinned, version)]
+                while len(self.versions) > self.keep and evictable:
+                    del self.versions[evictable.pop(0)]
+                self.latest = loaded
+            self.last_error = None
+            return loaded
+
+    def reload_in_background(self):
+        thread = threading.Thread(target=self._reload_safely, daemon=True)
+        thread.start()
+        return thread
+
+    def _reload_safely(self):
+        try:
+            loaded = self.load()
+            print(f"Loaded model version {loaded.version}")
+        except Exception as e:
+            # Keep serving the previous version
+            self.last_error = str(e)
+            print(f"Error loading model from {self.path}: {e}")
+
+    def _start_watching(self):
+        # Threads do not survive a fork, so each worker process starts its own watcher
+        if self.watch_interval <= 0 or self.watcher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.watcher_pid != os.getpid():
+                self.watcher_pid = os.getpid()
+                self.watcher = threading.Thread(target=self._watch, daemon=True)
+                self.watcher.start()
+
+    def _watch(self):
+        last_seen = self._stat()
+        while True:
+            time.sleep(self.watch_interval)
+            seen = self._stat()
+            if seen != last_seen:
+                last_seen = seen
+                self._reload_safely()
+
+    def _stat(self):
+        # A compact artifact changes when its manifest is replaced
+        path = os.path.join(self.path, 'manifest.json') if os.path.isdir(self.path) else self.path
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def pin(self, version):
+        if version not in self.versions:
+            raise KeyError(version)
+        self.pinned = version
+
+    def unpin(self):
+        self.pinned = None
+
+    def describe(self):
+        with self.lock:
+            return {
+                'path': self.path,
+                'latest': self.latest.version if self.latest else None,
+                'pinned': self.pinned,
+                'active': self.pinned or (self.latest.version if self.latest else None),
+                'last_error': self.last_error,
+                'versions': [loaded.describe() for loaded in self.versions.values()],
+            }
@@ -1,57 +1,346 @@
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split, cross_val_score, KFold
+from sklearn.model_selection import train_test_split, KFold
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.impute import SimpleImputer
-from sklearn.linear_model import ElasticNet
+from sklearn.linear_model import ElasticNet, Ridge
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.base import clone
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import itertools
+import json
 import pickle
-from car_data_prep import prepare_data
+import os
+import time
+import warnings
+from datetime import datetime
+from car_data_prep import DataPreparer, TEXT_DTYPES, timing_report
+from online_model import build_online_pipeline, update_pipeline
+from training_cache import TrainingCache
+from inference import CompiledModel
+from compact_model import save_compact
+from comparables import ComparablesIndex, build_listings
 
-# קריאה ל-CSV וטעינת הנתונים ל-DataFrame
-df = pd.read_csv("dataset.csv")
+# המודלים שנבדקים במצב כוונון: רשת של ElasticNet ו-Ridge
+ELASTIC_NET_ALPHAS = [0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1]
+ELASTIC_NET_L1_RATIOS = [0.1, 0.3, 0.5, 0.7, 0.9, 1.0]
+RIDGE_ALPHAS = [0.1, 0.3, 1.0, 3.0, 10.0]
 
-# הכנת הנתונים באמצעות הפונקציה שהועברה
-df_prepared = prepare_data(df)
 
-X = df_prepared.drop('Price', axis=1)
-y = df_prepared['Price']
+# המודל המקוון נשמר בנפרד מהמודל הרגיל
+ONLINE_MODEL_PATH = "online_model.pkl"
+COMPACT_MODEL_PATH = "trained_model.compact"
+COMPARABLES_PATH = "comparables.pkl"
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-numerical_types = ['int', 'int16', 'int32', 'int64', 'float', 'float16', 'float32', 'float64']
-numerical_features = X.select_dtypes(include=numerical_types).columns.tolist()
-categorical_features = X.select_dtypes(include=['object', 'category']).columns.tolist()
+def load_data(path, chunksize=None, timings=None, n_jobs=None):
+    # הכנת הנתונים - הסטטיסטיקות נלמדות פעם אחת ונשמרות יחד עם המודל
+    # כשמועבר מילון timings, הזמן של כל שלב בהכנה מתווסף אליו
+    preparer = DataPreparer()
+    if chunksize:
+        # קריאת ה-CSV בחלקים, כך שהנתונים הגולמיים לא נטענים לזיכרון במלואם
+        preparer.fit_csv(path, chunksize, timings=timings, n_jobs=n_jobs)
+        df_prepared = pd.concat(preparer.transform_csv(path, chunksize, timings=timings, n_jobs=n_jobs))
+    else:
+        # קריאה ל-CSV וטעינת הנתונים ל-DataFrame; עמודות הטקסט נקראות כטקסט גם כשכל הערכים בהן מספרים
+        start = time.perf_counter()
+        df = pd.read_csv(path, dtype=TEXT_DTYPES)
+        if timings is not None:
+            timings['read_csv'] = timings.get('read_csv', 0.0) + time.perf_counter() - start
+        df_prepared = preparer.fit_transform(df, timings, n_jobs)
 
-numerical_pipeline = Pipeline(steps=[
-    ('imputer', SimpleImputer(strategy='median')),
-    ('scaler', StandardScaler())
-])
+    X = df_prepared.drop('Price', axis=1)
+    y = df_prepared['Price']
+    return preparer, X, y
 
-categorical_pipeline = Pipeline(steps=[
-    ('imputer', SimpleImputer(strategy='most_frequent')),
-    ('onehot', OneHotEncoder(handle_unknown='ignore'))
-])
 
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('num', numerical_pipeline, numerical_features),
-        ('cat', categorical_pipeline, categorical_features)
-    ]
-)
+def load_prepared(path, cache=None, chunksize=None, timings=None, n_jobs=None):
+    # הנתונים המוכנים נשמרים במטמון לפי ה-hash של ה-CSV ושל קוד ההכנה
+    # מספר התהליכים לא משנה את התוצאה, ולכן אינו חלק מהמפתח
+    if cache is None:
+        return load_data(path, chunksize, timings, n_jobs)
+    # השנה הנוכחית היא חלק מההכנה (הוותק של הרכב), ולכן גם חלק מהמפתח
+    key = cache.key(path, stage='prepared', year=datetime.now().year)
+    entry = cache.load(key)
+    if entry is not None:
+        return entry['preparer'], entry['X'], entry['y']
+    preparer, X, y = load_data(path, chunksize, timings, n_jobs)
+    cache.store(key, frames={'X': X, 'y': y}, objects={'preparer': preparer})
+    return preparer, X, y
 
-# יצירת המודל ElasticNet עם הפרמטרים הכי טובים
-final_elastic_net = ElasticNet(alpha=0.001, l1_ratio=0.5)
 
-# עדכון הפייפליין עם המודל הכי טוב
-final_pipeline = Pipeline(steps=[
-    ('preprocessor', preprocessor),
-    ('model', final_elastic_net)
-])
+def preprocess_split(preprocessor, X_train, X_test, cache=None, key=None):
+    # מטריצות ה-design של האימון והבדיקה, מהמטמון אם קיימות
+    entry = cache.load(key) if cache is not None else None
+    if entry is not None:
+        return entry['preprocessor'], entry['X_train'], entry['X_test']
+    preprocessor = clone(preprocessor)
+    X_train_processed = preprocessor.fit_transform(X_train)
+    X_test_processed = preprocessor.transform(X_test)
+    if cache is not None:
+        cache.store(key, matrices={'X_train': X_train_processed, 'X_test': X_test_processed},
+                    objects={'preprocessor': preprocessor})
+    return preprocessor, X_train_processed, X_test_processed
 
-# התאמת הפייפליין הסופי על נתוני האימון
-final_pipeline.fit(X_train, y_train)
 
-pickle.dump(final_pipeline, open("trained_model.pkl", "wb"))
\ No newline at end of file
+def print_timing_report(report):
+    # פירוט זמני ההכנה לפי שלבים, מהשלב האיטי ביותר
+    print(f"Preparation of {report['rows']} rows took {report['seconds']:.2f}s:")
+    for step, result in sorted(report['steps'].items(), key=lambda item: -item[1]['seconds']):
+        stages = ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in result['stages'].items())
+        print(f"  {step:<14} {result['seconds']:>8.3f}s {result['share']:>6.1%}  ({stages})")
+
+
+def feature_columns(X):
+    numerical_types = ['int', 'int16', 'int32', 'int64', 'float', 'float16', 'float32', 'float64']
+    numerical_features = X.select_dtypes(include=numerical_types).columns.tolist()
+    categorical_features = X.select_dtypes(include=['object', 'category']).columns.tolist()
+    return numerical_features, categorical_features
+
+
+def build_preprocessor(X):
+    numerical_features, categorical_features = feature_columns(X)
+
+    numerical_pipeline = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='median')),
+        ('scaler', StandardScaler())
+    ])
+
+    categorical_pipeline = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='most_frequent')),
+        ('onehot', OneHotEncoder(handle_unknown='ignore'))
+    ])
+
+    return ColumnTransformer(
+        transformers=[
+            ('num', numerical_pipeline, numerical_features),
+            ('cat', categorical_pipeline, categorical_features)
+        ]
+    )
+
+
+def candidate_models():
+    candidates = [ElasticNet(alpha=alpha, l1_ratio=l1_ratio)
+                  for alpha, l1_ratio in itertools.product(ELASTIC_NET_ALPHAS, ELASTIC_NET_L1_RATIOS)]
+    candidates += [Ridge(alpha=alpha) for alpha in RIDGE_ALPHAS]
+    return candidates
+
+
+def describe_model(model):
+    params = model.get_params()
+    if isinstance(model, ElasticNet):
+        return f"ElasticNet(alpha={params['alpha']}, l1_ratio={params['l1_ratio']})"
+    return f"{type(model).__name__}(alpha={params['alpha']})"
+
+
+def regression_metrics(y_true, y_pred):
+    return {
+        'rmse': float(np.sqrt(mean_squared_error(y_true, y_pred))),
+        'mae': float(mean_absolute_error(y_true, y_pred)),
+        'r2': float(r2_score(y_true, y_pred)),
+    }
+
+
+# הפלט של ה-ColumnTransformer בכל fold, נטען פעם אחת בכל תהליך
+_FOLDS = None
+
+
+def _init_worker(folds):
+    global _FOLDS
+    _FOLDS = folds
+    # ערכי alpha קטנים לא תמיד מתכנסים, והתוצאה נמדדת בכל מקרה
+    warnings.filterwarnings('ignore', category=ConvergenceWarning)
+
+
+def _score_candidate(task):
+    candidate_index, model, fold_index = task
+    X_fold_train, y_fold_train, X_fold_valid, y_fold_valid = _FOLDS[fold_index]
+    fitted = clone(model).fit(X_fold_train, y_fold_train)
+    return candidate_index, regression_metrics(y_fold_valid, fitted.predict(X_fold_valid))
+
+
+def preprocess_folds(preprocessor, X, y, n_splits):
+    # ה-preprocessor מותאם פעם אחת לכל fold, וכל המודלים משתמשים באותו פלט
+    folds = []
+    for train_index, valid_index in KFold(n_splits=n_splits, shuffle=True, random_state=42).split(X):
+        fold_preprocessor = clone(preprocessor)
+        X_fold_train = fold_preprocessor.fit_transform(X.iloc[train_index])
+        X_fold_valid = fold_preprocessor.transform(X.iloc[valid_index])
+        folds.append((X_fold_train, y.iloc[train_index].to_numpy(), X_fold_valid, y.iloc[valid_index].to_numpy()))
+    return folds
+
+
+def tune(preprocessor, X, y, n_splits=5, jobs=None):
+    start = time.perf_counter()
+    folds = preprocess_folds(preprocessor, X, y, n_splits)
+    preprocess_seconds = time.perf_counter() - start
+
+    # כל זוג של מודל ו-fold הוא משימה נפרדת במאגר התהליכים
+    candidates = candidate_models()
+    tasks = [(i, model, fold_index) for i, model in enumerate(candidates) for fold_index in range(n_splits)]
+    scores = [[] for _ in candidates]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(folds,)) as executor:
+        for candidate_index, fold_scores in executor.map(_score_candidate, tasks, chunksize=4):
+            scores[candidate_index].append(fold_scores)
+
+    results = []
+    for model, fold_scores in zip(candidates, scores):
+        result = {'model': model, 'name': describe_model(model)}
+        for metric in ['rmse', 'mae', 'r2']:
+            values = [fold[metric] for fold in fold_scores]
+            result[metric] = float(np.mean(values))
+            result[f'{metric}_std'] = float(np.std(values))
+        results.append(result)
+    results.sort(key=lambda result: result['rmse'])
+
+    print(f"Preprocessed {n_splits} folds in {preprocess_seconds:.2f}s, "
+          f"scored {len(candidates)} candidates in {time.perf_counter() - start:.2f}s")
+    for result in results[:10]:
+        print(f"  {result['name']:<45} RMSE {result['rmse']:>10.1f} ± {result['rmse_std']:<8.1f} "
+              f"MAE {result['mae']:>10.1f}  R2 {result['r2']:.4f}")
+    return results
+
+
+def save_model(pipeline, preparer, path="trained_model.pkl"):
+    # שמירת הפייפליין יחד עם ה-preparer המותאם, לשימוש ב-api
+    # הכתיבה לקובץ זמני והחלפה אטומית, כדי שה-api לא יטען קובץ חלקי
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump({'pipeline': pipeline, 'preparer': preparer}, f)
+    os.replace(path + ".tmp", path)
+
+
+def export_compact_model(pipeline, preparer, path=COMPACT_MODEL_PATH):
+    # ייצוא המודל כמערכי NumPy (פרמטרי ה-scaler, ערכי ההשלמה, אוצרות המילים של ה-one-hot, המקדמים וה-intercept)
+    # ה-api טוען אותו בלי sklearn ובלי pandas, ובלי תלות בגרסת sklearn שבה אומן המודל
+    compiled = CompiledModel.from_artifact({'pipeline': pipeline, 'preparer': preparer})
+    return save_compact(compiled, path)
+
+
+def load_model(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def update_online_model(path, data_path):
+    # עדכון המודל המקוון עם הרשומות החדשות בלבד, בלי לקרוא שוב את הנתונים הישנים
+    start = time.perf_counter()
+    artifact = load_model(path)
+    preparer, pipeline = artifact['preparer'], artifact['pipeline']
+
+    # הכנת הרשומות החדשות עם הסטטיסטיקות שנלמדו באימון הראשון
+    df_prepared = preparer.transform(pd.read_csv(data_path, dtype=TEXT_DTYPES))
+    X = df_prepared.drop('Price', axis=1)
+    y = df_prepared['Price']
+
+    # הציון על הרשומות החדשות לפני העדכון, כלומר על נתונים שהמודל עוד לא ראה
+    before = regression_metrics(y, pipeline.predict(X))
+    update_pipeline(pipeline, X, y)
+    print(f"Updated with {len(X)} rows in {time.perf_counter() - start:.2f}s, "
+          f"RMSE on the new rows before the update {before['rmse']:.1f}")
+
+    save_model(pipeline, preparer, path)
+    print(f"Saved {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the car price model")
+    parser.add_argument('--data', default="dataset.csv")
+    parser.add_argument('--output', default=None,
+                        help=f"trained_model.pkl, or {ONLINE_MODEL_PATH} with --online/--update")
+    parser.add_argument('--tune', action='store_true', help="cross-validated search over the candidate models")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes for --tune (all cores by default)")
+    parser.add_argument('--online', action='store_true', help="train the incrementally updatable model")
+    parser.add_argument('--update', metavar='CSV', help="update the online model with the listings in CSV")
+    parser.add_argument('--chunksize', type=int, default=None, help="prepare the CSV in chunks of this many rows")
+    parser.add_argument('--no-cache', action='store_true', help="prepare the data again instead of using .cache/")
+    parser.add_argument('--prep-jobs', type=int, default=None,
+                        help="worker processes for the description pass of the preparation (-1 for all cores)")
+    parser.add_argument('--timings', metavar='JSON', help="write the per-step timing report of the preparation to this file")
+    parser.add_argument('--export', nargs='?', const=COMPACT_MODEL_PATH, metavar='DIR',
+                        help=f"also write the compact artifact served without sklearn ({COMPACT_MODEL_PATH} by default)")
+    parser.add_argument('--comparables', default=COMPARABLES_PATH, metavar='PATH',
+                        help="where to write the nearest-neighbour index of the listings served by /comparables")
+    args = parser.parse_args()
+    # רק מודל לינארי עם one-hot ניתן לייצוא; המודל המקוון נשאר בפורמט pickle
+    if args.export and (args.online or args.update):
+        parser.error("--export needs the regular model; the online model is only saved as a pickle")
+
+    if args.update:
+        update_online_model(args.output or ONLINE_MODEL_PATH, args.update)
+        return
+    output = args.output or (ONLINE_MODEL_PATH if args.online else "trained_model.pkl")
+
+    start = time.perf_counter()
+    cache = None if args.no_cache else TrainingCache()
+    timings = {}
+    preparer, X, y = load_prepared(args.data, cache, args.chunksize, timings, args.prep_jobs)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    preprocessor = build_preprocessor(X)
+    print(f"Prepared {len(X)} rows in {time.perf_counter() - start:.2f}s")
+
+    # כשהנתונים נטענו מהמטמון אין שלבי הכנה למדוד
+    if timings:
+        report = timing_report(timings, len(X))
+        print_timing_report(report)
+        if args.timings:
+            with open(args.timings, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+    elif args.timings:
+        print(f"Prepared data was loaded from the cache, no timings written to {args.timings} (use --no-cache)")
+
+    if args.online:
+        # מודל SGD עם קידוד hashing, שאפשר לעדכן בהמשך עם --update
+        final_pipeline = build_online_pipeline(*feature_columns(X))
+    elif args.tune:
+        # בחירת המודל עם ה-RMSE הנמוך ביותר ב-cross validation על נתוני האימון
+        best = tune(preprocessor, X_train, y_train, n_splits=args.folds, jobs=args.jobs)[0]
+        final_model = clone(best['model'])
+        print(f"Best model: {best['name']}")
+    else:
+        # יצירת המודל ElasticNet עם הפרמטרים הכי טובים
+        final_model = ElasticNet(alpha=0.001, l1_ratio=0.5)
+
+    if args.online:
+        # התאמת הפייפליין הסופי על נתוני האימון
+        final_pipeline.fit(X_train, y_train)
+        test_predictions = final_pipeline.predict(X_test)
+    else:
+        # ה-preprocessor מותאם רק על נתוני האימון, כך שהמטמון תלוי גם בחלוקה
+        split_key = cache.key(args.data, stage='split', year=datetime.now().year, test_size=0.2,
+                              random_state=42, preprocessor=repr(preprocessor)) if cache is not None else None
+        preprocessor, X_train_processed, X_test_processed = preprocess_split(preprocessor, X_train, X_test, cache, split_key)
+
+        # התאמת המודל הסופי על נתוני האימון
+        final_model.fit(X_train_processed, y_train)
+        test_predictions = final_model.predict(X_test_processed)
+
+        # עדכון הפייפליין עם המודל הכי טוב
+        final_pipeline = Pipeline(steps=[
+            ('preprocessor', preprocessor),
+            ('model', final_model)
+        ])
+
+    test_scores = regression_metrics(y_test, test_predictions)
+    print(f"Test RMSE {test_scores['rmse']:.1f}  MAE {test_scores['mae']:.1f}  R2 {test_scores['r2']:.4f}")
+
+    save_model(final_pipeline, preparer, output)
+    print(f"Saved {output} in {time.perf_counter() - start:.2f}s")
+
+    if args.export:
+        manifest = export_compact_model(final_pipeline, preparer, args.export)
+        print(f"Exported {args.export} ({len(manifest['arrays'])} arrays)")
+
+    if not args.online and args.comparables:
+        # אינדקס המודעות הדומות נבנה מכל הנתונים המוכנים, עם הקילומטראז' המקורי מהקובץ
+        listings = build_listings(pd.concat([X, y], axis=1), pd.read_csv(args.data, usecols=['Km'])['Km'])
+        ComparablesIndex().fit(listings).save(args.comparables)
+        print(f"Saved {args.comparables} ({len(listings)} listings)")
+
+
+if __name__ == '__main__':
+    main()
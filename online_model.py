@@ -0,0 +1,93 @@
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin, RegressorMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import SGDRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+# Size of the hashed categorical feature space
+HASHED_FEATURES = 2 ** 18
+
+
+class HashingEncoder(BaseEstimator, TransformerMixin):
+    """Encodes categorical columns as hashed 'column=value' tokens.
+
+    Unlike one-hot encoding there is no vocabulary to learn, so a new
+    manufacturer or model gets a column of its own without changing the
+    layout the regressor was trained on.
+    """
+
+    def __init__(self, columns, n_features=HASHED_FEATURES):
+        self.columns = columns
+        self.n_features = n_features
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        hasher = FeatureHasher(n_features=self.n_features, input_type='string', alternate_sign=False)
+        rows = np.asarray(X, dtype=object)
+        return hasher.transform([f'{column}={value}' for column, value in zip(self.columns, row)] for row in rows)
+
+
+class OnlineRegressor(BaseEstimator, RegressorMixin):
+    """SGDRegressor on a standardized target, updatable with partial_fit.
+
+    The target mean and scale are taken from the first fit and kept, so
+    later updates keep learning on the same scale.
+    """
+
+    def __init__(self, alpha=0.00001, eta0=0.1, epochs=20, random_state=42):
+        self.alpha = alpha
+        self.eta0 = eta0
+        self.epochs = epochs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        y = np.asarray(y, dtype=float)
+        self.y_mean_ = float(y.mean())
+        self.y_scale_ = float(y.std()) or 1.0
+        self.sgd_ = SGDRegressor(alpha=self.alpha, eta0=self.eta0, learning_rate='invscaling',
+                                 random_state=self.random_state)
+        self.random_state_ = np.random.RandomState(self.random_state)
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y, epochs=None):
+        # A few shuffled passes over the new rows only
+        y = (np.asarray(y, dtype=float) - self.y_mean_) / self.y_scale_
+        for _ in range(epochs or self.epochs):
+            order = self.random_state_.permutation(len(y))
+            self.sgd_.partial_fit(X[order], y[order])
+        return self
+
+    def predict(self, X):
+        return self.sgd_.predict(X) * self.y_scale_ + self.y_mean_
+
+
+def build_online_pipeline(numerical_features, categorical_features, **regressor_params):
+    # The imputers and the scaler are fitted once, on the initial data, and are not refitted by updates
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', Pipeline(steps=[
+                ('imputer', SimpleImputer(strategy='median')),
+                ('scaler', StandardScaler())
+            ]), numerical_features),
+            ('cat', Pipeline(steps=[
+                ('imputer', SimpleImputer(strategy='most_frequent')),
+                ('hasher', HashingEncoder(categorical_features))
+            ]), categorical_features)
+        ]
+    )
+    return Pipeline(steps=[
+        ('preprocessor', preprocessor),
+        ('model', OnlineRegressor(**regressor_params))
+    ])
+
+
+def update_pipeline(pipeline, X, y, epochs=None):
+    # Only the new rows are transformed and learned from
+    processed = pipeline.named_steps['preprocessor'].transform(X)
+    pipeline.named_steps['model'].partial_fit(processed, y, epochs)
+    return pipeline
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """In-process LRU cache of predictions with a time to live.
+
+    Entries belong to the model version they were computed with; the first
+    lookup or insert with another version empties the cache, so a new model
+    never serves stale predictions.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.model_version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, model_version):
+        if model_version != self.model_version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.model_version = model_version
+
+    def get(self, key, model_version):
+        with self.lock:
+            self._check_version(model_version)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, model_version):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self._check_version(model_version)
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'model_version': self.model_version,
+            }
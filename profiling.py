@@ -0,0 +1,47 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import uuid
+
+
+class RequestProfiler:
+    """Runs selected requests under cProfile and reports where the time went.
+
+    mode is 'off', 'header' (only requests sending the header are
+    profiled) or 'always'. The report holds the top functions by
+    cumulative time; when a directory is set, the raw stats are also
+    written there as <id>.prof for snakeviz or pstats.
+    """
+
+    def __init__(self, mode='off', directory=None, top=30, header='X-Profile'):
+        if mode not in ('off', 'header', 'always'):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.top = top
+        self.header = header
+
+    def requested(self, headers):
+        if self.mode == 'always':
+            return True
+        return self.mode == 'header' and headers.get(self.header, '').lower() in ('1', 'true', 'yes')
+
+    def run(self, func, *args, **kwargs):
+        # Returns the result of func and the profile of the call
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        result = profiler.runcall(func, *args, **kwargs)
+        seconds = time.perf_counter() - start
+
+        profile_id = uuid.uuid4().hex[:12]
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        report = {'id': profile_id, 'seconds': round(seconds, 6), 'stats': stream.getvalue()}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            report['path'] = os.path.join(self.directory, f'{profile_id}.prof')
+            stats.dump_stats(report['path'])
+        return result, report
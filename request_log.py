@@ -0,0 +1,137 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+def _json_value(value):
+    # Empty numeric fields are NaN, which is not valid JSON
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _json_value(item) for key, item in value.items()}
+    return value
+
+
+class RequestLogger:
+    """Append-only JSON lines log written off the request threads.
+
+    log() only appends the record to an in-memory buffer of at most
+    capacity records; when the buffer is full the record is dropped and
+    counted, so a slow disk never blocks a request. A background thread
+    writes the buffered records in one batch every flush_interval seconds,
+    or sooner once batch_size of them are waiting.
+
+    The file is rotated to <name>-<timestamp><ext> when it reaches
+    max_bytes or, if max_age is set, when it is older than max_age seconds.
+    close() writes what is left and runs at interpreter exit.
+    """
+
+    def __init__(self, path, capacity=10000, flush_interval=1.0, batch_size=500, max_bytes=50 * 1024 * 1024, max_age=None):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.writer = None
+        self.writer_pid = None
+        self.file_started = None
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def log(self, record):
+        # Returns False when the record was dropped
+        self._start_writer()
+        with self.lock:
+            if self.closed or len(self.buffer) >= self.capacity:
+                self.dropped += 1
+                return False
+            self.buffer.append(record)
+            full_batch = len(self.buffer) >= self.batch_size
+        if full_batch:
+            self.wakeup.set()
+        return True
+
+    def _start_writer(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer_pid != os.getpid():
+                self.buffer = deque()
+                self.writer = threading.Thread(target=self._run, daemon=True)
+                self.writer.start()
+                self.writer_pid = os.getpid()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            records, self.buffer = self.buffer, deque()
+        if not records:
+            return
+        lines = ''.join(json.dumps(_json_value(record), ensure_ascii=False, default=str) + '\n' for record in records)
+        with self.write_lock:
+            try:
+                self._rotate_if_needed()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+                if self.file_started is None:
+                    self.file_started = time.time()
+                self.written += len(records)
+            except OSError as e:
+                # The records are lost, the requests are not
+                self.errors += 1
+                self.dropped += len(records)
+                print(f"Error writing {self.path}: {e}")
+
+    def _rotate_if_needed(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self.file_started = None
+            return
+        too_old = self.max_age and self.file_started is not None and time.time() - self.file_started >= self.max_age
+        if size == 0 or not (size >= self.max_bytes or too_old):
+            return
+        stem, ext = os.path.splitext(self.path)
+        rotated = f"{stem}-{datetime.now():%Y%m%d-%H%M%S}{ext}"
+        suffix = 1
+        while os.path.exists(rotated):
+            rotated = f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.{suffix}{ext}"
+            suffix += 1
+        os.replace(self.path, rotated)
+        self.file_started = None
+        self.rotations += 1
+
+    def close(self, timeout=5):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        if self.writer is not None and self.writer_pid == os.getpid():
+            self.writer.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            buffered = len(self.buffer)
+        return {'written': self.written, 'dropped': self.dropped, 'buffered': buffered,
+                'rotations': self.rotations, 'errors': self.errors}
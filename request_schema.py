@@ -0,0 +1,201 @@
+import math
+import re
+from datetime import datetime
+
+from description_matcher import GEARS, ENGINE_TYPES, OWNERSHIP_TYPES
+from inference import is_kept_km
+
+# The fields of a /predict request, in the order of the form
+FIELDS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type',
+          'Prev_ownership', 'Curr_ownership', 'Description', 'Km', 'Test']
+
+# Allowed range of each numeric field; an empty value is allowed everywhere but Km
+NUMERIC_RANGES = {
+    'Year': (1900, datetime.now().year + 1),
+    'Hand': (0, 20),
+    'capacity_Engine': (0, 20000),
+    'Km': (0, 5000000),
+}
+WHOLE_NUMBERS = {'Year', 'Hand'}
+REQUIRED = {'Km'}
+
+# Values the data preparation knows, including the ones it replaces or treats as undefined
+KNOWN_VALUES = {
+    'Gear': set(GEARS),
+    'Engine_type': set(ENGINE_TYPES),
+    'Prev_ownership': set(OWNERSHIP_TYPES) | {'חברה', 'אחר', 'לא מוגדר', 'None'},
+    'Curr_ownership': set(OWNERSHIP_TYPES) | {'חברה', 'אחר', 'לא מוגדר', 'None'},
+}
+
+# Longest accepted text values, so oversized input never reaches the description matcher
+MAX_LENGTHS = {'Description': 5000}
+DEFAULT_MAX_LENGTH = 100
+
+NUMBER_PATTERN = re.compile(r'[+-]?(\d+(\.\d*)?|\.\d+)')
+THOUSANDS_PATTERN = re.compile(r'\d{1,3}(,\d{3})+(\.\d*)?')
+
+# Test is a date like the form placeholder, a month like 'Nov-24' or days until the test, like in dataset.csv
+TEST_DATE_FORMATS = ['%d/%m/%Y', '%b-%y']
+TEST_DAYS_PATTERN = re.compile(r'-?\d+')
+TEST_PLACEHOLDERS = {'None'}
+
+# Fields a /predict/sweep request can vary, and the largest grid it may ask for. Km is not one of
+# them: the data preparation replaces it with a value derived from Year, so prices would not change.
+SWEEP_FIELDS = ['Year', 'Hand', 'capacity_Engine']
+MAX_SWEEP_POINTS = 10000
+
+
+class InvalidRequest(ValueError):
+    def __init__(self, errors):
+        super().__init__('; '.join(f'{field}: {message}' for field, message in errors.items()))
+        self.errors = errors
+
+
+class CarRecord:
+    """A validated /predict request.
+
+    Numeric fields hold floats (NaN when empty), text fields hold strings
+    ('' when empty), exactly what the prediction paths expect from the form.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for field in FIELDS:
+            setattr(self, field, values[field])
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+
+def _number(field, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("must be a number")
+    if isinstance(value, str):
+        text = value.strip()
+        if THOUSANDS_PATTERN.fullmatch(text):
+            text = text.replace(',', '')
+        if not NUMBER_PATTERN.fullmatch(text):
+            raise ValueError("must be a number")
+        value = float(text)
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError("must be a number")
+    if field in WHOLE_NUMBERS and not value.is_integer():
+        raise ValueError("must be a whole number")
+    low, high = NUMERIC_RANGES[field]
+    if not low <= value <= high:
+        raise ValueError(f"must be between {low} and {high}")
+    return value
+
+
+def _text(field, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("must be a string")
+    # JSON clients may send a model name like 3 as a number
+    value = value if isinstance(value, str) else str(value)
+    max_length = MAX_LENGTHS.get(field, DEFAULT_MAX_LENGTH)
+    if len(value) > max_length:
+        raise ValueError(f"must be at most {max_length} characters")
+    if value and field in KNOWN_VALUES and value not in KNOWN_VALUES[field]:
+        raise ValueError(f"unknown value '{value}'")
+    if value and field == 'Test' and not _is_test_date(value):
+        raise ValueError("must be a date as DD/MM/YYYY or a number of days")
+    return value
+
+
+def _is_test_date(value):
+    if value in TEST_PLACEHOLDERS or TEST_DAYS_PATTERN.fullmatch(value):
+        return True
+    for date_format in TEST_DATE_FORMATS:
+        try:
+            datetime.strptime(value, date_format)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def parse_car(data):
+    """Validates and coerces a form or JSON object into a CarRecord in one pass.
+
+    Every invalid field is reported at once, by raising InvalidRequest.
+    """
+    if not hasattr(data, 'get'):
+        raise InvalidRequest({'body': "must be a form or a JSON object"})
+    values, errors = {}, {}
+    for field in FIELDS:
+        value = data.get(field)
+        empty = value is None or (isinstance(value, str) and not value.strip())
+        try:
+            if field in NUMERIC_RANGES:
+                if empty and field in REQUIRED:
+                    raise ValueError("is required")
+                values[field] = math.nan if empty else _number(field, value)
+            else:
+                values[field] = '' if value is None else _text(field, value)
+        except ValueError as e:
+            errors[field] = str(e)
+    if 'Km' not in errors and not is_kept_km(values['Km']):
+        # The data preparation drops rows with this placeholder Km
+        errors['Km'] = "is not a real Km value"
+    if errors:
+        raise InvalidRequest(errors)
+    return CarRecord(**values)
+
+
+def _sweep_values(field, spec):
+    # A list of values, or a range as {'start', 'stop', 'step'} with the stop included
+    if isinstance(spec, list):
+        values = [_number(field, value) for value in spec]
+    elif isinstance(spec, dict):
+        start, stop = _number(field, spec.get('start')), _number(field, spec.get('stop'))
+        step = spec.get('step', 1)
+        if isinstance(step, bool) or not isinstance(step, (int, float)) or not step > 0:
+            raise ValueError("step must be a positive number")
+        count = math.floor((stop - start) / step + 1e-9) + 1
+        if count > MAX_SWEEP_POINTS:
+            raise ValueError(f"must have at most {MAX_SWEEP_POINTS} values")
+        values = [_number(field, round(start + i * step, 9)) for i in range(count)]
+    else:
+        raise ValueError("must be a list of values or a range")
+    if not values:
+        raise ValueError("must have at least one value")
+    return values
+
+
+def parse_sweep(data):
+    """Validates a /predict/sweep request: a base car and the values of the numeric fields to sweep.
+
+    Returns the CarRecord and {field: [values]} in the order of the request.
+    Each swept field of the base car takes its first value.
+    """
+    if not isinstance(data, dict):
+        raise InvalidRequest({'body': "must be a JSON object"})
+    car, sweep = data.get('car', {}), data.get('sweep')
+    axes, errors = {}, {}
+    if not isinstance(sweep, dict) or not sweep:
+        errors['sweep'] = f"must map some of {', '.join(SWEEP_FIELDS)} to values or ranges"
+        sweep = {}
+    for field, spec in sweep.items():
+        try:
+            if field == 'Km':
+                raise ValueError("cannot be swept: the model derives Km from Year, so the prices would not change")
+            if field not in SWEEP_FIELDS:
+                raise ValueError(f"cannot be swept, only {', '.join(SWEEP_FIELDS)} can")
+            axes[field] = _sweep_values(field, spec)
+        except ValueError as e:
+            errors[f'sweep.{field}'] = str(e)
+    if math.prod(len(values) for values in axes.values()) > MAX_SWEEP_POINTS:
+        errors['sweep'] = f"must have at most {MAX_SWEEP_POINTS} points"
+
+    try:
+        record = parse_car(dict(car, **{field: values[0] for field, values in axes.items()})
+                           if isinstance(car, dict) else car)
+    except InvalidRequest as e:
+        # A swept field with invalid values is already reported under sweep
+        errors.update({f'car.{field}' if field != 'body' else 'car': message
+                       for field, message in e.errors.items() if field not in sweep})
+    if errors:
+        raise InvalidRequest(errors)
+    return record, axes
@@ -0,0 +1,182 @@
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import api
+
+# Address, number of worker processes and shutdown timeouts, from the environment
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 5000))
+WORKERS = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+GRACEFUL_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT', 30))
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 5))
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Idle keep-alive connections are closed, so a draining worker is not held open by them
+    timeout = KEEPALIVE_TIMEOUT
+
+    def log_request(self, *args, **kwargs):
+        # The access log of the dev server costs more than a prediction
+        pass
+
+
+def run_worker(listener):
+    # Admin calls that change the model are passed to the master, see api.reload_model
+    api.master_pid = os.getppid()
+
+    # Restore the default signal handlers inherited from the master. Ctrl+C reaches the
+    # whole process group, and the master answers it by draining the workers.
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    server = make_server(HOST, PORT, api.app, threaded=True, request_handler=RequestHandler, fd=listener.fileno())
+    # Wait for the requests in progress when the server closes
+    server.daemon_threads = False
+
+    def drain(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot run in this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # os._exit skips atexit, so the buffered request log is written here
+        if api.request_log is not None:
+            api.request_log.close()
+    os._exit(0)
+
+
+class Master:
+    """Forks the workers and keeps the expected number of them running.
+
+    The model is loaded and warmed up here before the first fork, so every
+    worker starts with it in copy-on-write memory and serves its first
+    request without loading anything. SIGTERM/SIGINT drain the workers and
+    exit; SIGHUP, also sent by POST /admin/models/reload, reloads the model
+    and replaces the workers one at a time.
+
+    Each worker keeps its own prediction cache and metrics: /metrics and
+    /cache/stats describe the worker that answered, and every series has a
+    worker label so Prometheus can sum them.
+    """
+
+    def __init__(self, listener, workers):
+        self.listener = listener
+        self.workers = workers
+        self.pids = set()
+        self.stopping = False
+        self.restart_requested = False
+
+    def preload(self):
+        # Loading the model runs the warmup prediction through both prediction paths
+        loaded = api.registry.load()
+        # Objects that exist before the fork are never moved by the collector, so their pages stay shared
+        gc.collect()
+        gc.freeze()
+        return loaded
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.listener)
+            finally:
+                os._exit(1)
+        self.pids.add(pid)
+        return pid
+
+    def stop_workers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            remaining -= self.reap()
+            time.sleep(0.05)
+        for pid in remaining:
+            # The worker did not drain in time
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+            self.pids.discard(pid)
+
+    def reap(self):
+        exited = set()
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            exited.add(pid)
+            self.pids.discard(pid)
+        return exited
+
+    def rolling_restart(self):
+        try:
+            loaded = self.preload()
+            print(f"Restarting workers with model version {loaded.version}")
+        except Exception as e:
+            print(f"Error loading model, the workers keep the previous one: {e}")
+            return
+        # Start each replacement before the worker it replaces is drained
+        for pid in list(self.pids):
+            self.spawn()
+            self.stop_workers([pid])
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_restart(self, signum, frame):
+        self.restart_requested = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+
+        loaded = self.preload()
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"Serving model version {loaded.version} on {HOST}:{PORT} with {self.workers} workers")
+
+        while not self.stopping:
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            # Replace workers that died on their own
+            self.reap()
+            while len(self.pids) < self.workers and not self.stopping:
+                self.spawn()
+            time.sleep(0.2)
+
+        self.stop_workers(list(self.pids))
+        self.listener.close()
+
+
+def main():
+    if not hasattr(os, 'fork'):
+        sys.exit("serve.py needs os.fork(); run 'python api.py' on this platform")
+    listener = socket.create_server((HOST, PORT), backlog=1024)
+    listener.set_inheritable(True)
+    Master(listener, WORKERS).run()
+
+
+if __name__ == '__main__':
+    main()
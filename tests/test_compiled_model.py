@@ -0,0 +1,92 @@
+"""Parity of the compiled lookup-table model with the scikit-learn pipeline.
+
+CompiledModel.predict is compared with the pandas path of /predict on
+dataset rows, as they are and with some fields blanked, and the compact
+artifact written by save_compact with the pickled model it came from.
+"""
+import math
+import os
+import pickle
+import random
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the tests out of the request log; set before api is imported
+os.environ['REQUEST_LOG_PATH'] = ''
+
+import api
+from compact_model import load_compact, save_compact
+from inference import CompiledModel, RowDroppedError
+from model_registry import LoadedModel
+
+FIELDS = ['manufactor', 'Year', 'model', 'Hand', 'Gear', 'capacity_Engine', 'Engine_type',
+          'Prev_ownership', 'Curr_ownership', 'Description', 'Km', 'Test']
+
+
+@pytest.fixture(scope='module')
+def artifact():
+    with open(os.path.join(ROOT, 'trained_model.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    return pd.read_csv(os.path.join(ROOT, 'dataset.csv'), dtype=str, keep_default_na=False)
+
+
+def form_records(dataset, rows, seed=0):
+    # Each row as the /predict form sends it, and a copy with three of the car fields left empty
+    rng = random.Random(seed)
+    records = []
+    for record in dataset.head(rows)[FIELDS].to_dict('records'):
+        records.append(record)
+        records.append(dict(record, **{field: '' for field in rng.sample(FIELDS[:9], 3)}))
+    return records
+
+
+def predict_or_drop(predict, record):
+    try:
+        return predict(record)
+    except RowDroppedError:
+        return None
+
+
+def test_compiled_matches_pandas_path(artifact, dataset):
+    loaded = LoadedModel('test', artifact, 'trained_model.pkl')
+    assert loaded.compiled is not None
+    for record in form_records(dataset, rows=200):
+        try:
+            expected = api.predict_with_pandas(loaded, record)
+        except Exception:
+            # Cars the pandas path cannot predict are not predicted by the compiled one either
+            with pytest.raises(Exception):
+                loaded.compiled.predict(record)
+            continue
+        assert loaded.compiled.predict(record) == pytest.approx(expected, rel=1e-9), record
+
+
+def test_compact_round_trip(artifact, dataset, tmp_path):
+    compiled = CompiledModel.from_artifact(artifact)
+    save_compact(compiled, str(tmp_path))
+    compact = load_compact(str(tmp_path))
+    for record in form_records(dataset, rows=len(dataset)):
+        assert predict_or_drop(compact.predict, record) == predict_or_drop(compiled.predict, record), record
+
+
+def test_compact_frames_match_pickle(artifact, tmp_path):
+    save_compact(CompiledModel.from_artifact(artifact), str(tmp_path))
+    compact = LoadedModel('compact', {'compiled': load_compact(str(tmp_path))}, str(tmp_path))
+    pickled = LoadedModel('pickle', artifact, 'trained_model.pkl')
+
+    # Raw CSV rows, with the thousands separators and odd values the DataFrame preparation handles
+    frame = pd.read_csv(os.path.join(ROOT, 'dataset.csv'), dtype={'model': str}).head(300)
+    expected = pickled.predict_frame(frame.copy())
+    actual = compact.predict_frame(frame.copy())
+    assert list(actual.index) == list(expected.index)
+    assert max(abs(actual - expected)) == pytest.approx(0, abs=1e-6)
+    assert not any(math.isnan(value) for value in actual)
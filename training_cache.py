@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Bumped when the layout of a cache entry changes
+CACHE_FORMAT = 1
+
+# The preparation code: any change to these files gives new cache keys
+PREPARATION_SOURCES = ['car_data_prep.py', 'description_matcher.py']
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_digest(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+
+class TrainingCache:
+    """Content-addressed cache of prepared training data.
+
+    An entry lives in ``<root>/<key>/`` and holds DataFrames as one .npy
+    file per column, matrices as .npy files (the data/indices/indptr parts
+    for sparse ones) and fitted objects as pickles. Arrays are opened
+    memory-mapped, so loading an entry reads almost nothing up front.
+    Entries are written to a temporary directory and renamed into place,
+    so a reader never sees a partial one.
+    """
+
+    def __init__(self, root=os.path.join(ROOT, '.cache', 'training')):
+        self.root = root
+
+    def key(self, csv_path, **params):
+        # Hash of the input CSV, the preparation code and the parameters of what is cached
+        digest = hashlib.sha256(f'format={CACHE_FORMAT}'.encode())
+        file_digest(csv_path, digest)
+        for name in PREPARATION_SOURCES:
+            file_digest(os.path.join(ROOT, name), digest)
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()[:20]
+
+    def load(self, key):
+        path = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        entry = {}
+        for name, spec in manifest['frames'].items():
+            entry[name] = self._load_frame(path, name, spec)
+        for name, spec in manifest['matrices'].items():
+            entry[name] = self._load_matrix(path, name, spec)
+        for name in manifest['objects']:
+            with open(os.path.join(path, f'{name}.pkl'), 'rb') as f:
+                entry[name] = pickle.load(f)
+        return entry
+
+    def store(self, key, frames=None, matrices=None, objects=None):
+        path = os.path.join(self.root, key)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        os.makedirs(tmp_path)
+        try:
+            manifest = {'format': CACHE_FORMAT, 'frames': {}, 'matrices': {}, 'objects': []}
+            for name, frame in (frames or {}).items():
+                manifest['frames'][name] = self._store_frame(tmp_path, name, frame)
+            for name, matrix in (matrices or {}).items():
+                manifest['matrices'][name] = self._store_matrix(tmp_path, name, matrix)
+            for name, obj in (objects or {}).items():
+                with open(os.path.join(tmp_path, f'{name}.pkl'), 'wb') as f:
+                    pickle.dump(obj, f)
+                manifest['objects'].append(name)
+            with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another run stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    def _store_frame(self, path, name, frame):
+        is_series = isinstance(frame, pd.Series)
+        df = frame.to_frame() if is_series else frame
+        np.save(os.path.join(path, f'{name}.index.npy'), df.index.to_numpy())
+        columns = []
+        for i, column in enumerate(df.columns):
+            values = df[column]
+            if values.dtype.kind in 'biuf':
+                np.save(os.path.join(path, f'{name}.{i}.npy'), values.to_numpy())
+                columns.append({'name': column, 'dtype': values.dtype.str})
+            else:
+                # Text columns as fixed-width unicode, which can be memory-mapped, and a mask of missing values
+                missing = values.isna().to_numpy()
+                np.save(os.path.join(path, f'{name}.{i}.npy'), np.where(missing, '', values.astype(str)).astype(str))
+                np.save(os.path.join(path, f'{name}.{i}.missing.npy'), missing)
+                columns.append({'name': column, 'dtype': 'object'})
+        return {'series': is_series, 'columns': columns}
+
+    def _load_frame(self, path, name, spec):
+        index = np.load(os.path.join(path, f'{name}.index.npy'), allow_pickle=True)
+        data = {}
+        for i, column in enumerate(spec['columns']):
+            values = np.load(os.path.join(path, f'{name}.{i}.npy'), mmap_mode='r')
+            if column['dtype'] == 'object':
+                values = values.astype(object)
+                values[np.load(os.path.join(path, f'{name}.{i}.missing.npy'))] = np.nan
+            data[column['name']] = values
+        df = pd.DataFrame(data, index=index, copy=False)
+        return df.iloc[:, 0] if spec['series'] else df
+
+    def _store_matrix(self, path, name, matrix):
+        if sparse.issparse(matrix):
+            matrix = sparse.csr_matrix(matrix)
+            for part in ['data', 'indices', 'indptr']:
+                np.save(os.path.join(path, f'{name}.{part}.npy'), getattr(matrix, part))
+            return {'sparse': True, 'shape': list(matrix.shape)}
+        np.save(os.path.join(path, f'{name}.npy'), np.asarray(matrix))
+        return {'sparse': False}
+
+    def _load_matrix(self, path, name, spec):
+        if spec['sparse']:
+            parts = [np.load(os.path.join(path, f'{name}.{part}.npy'), mmap_mode='r') for part in ['data', 'indices', 'indptr']]
+            return sparse.csr_matrix(tuple(parts), shape=tuple(spec['shape']), copy=False)
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')